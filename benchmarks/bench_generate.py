@@ -0,0 +1,129 @@
+"""
+Times and memory-profiles each stage of generating GPX files from a synthetic export.
+
+    python -m benchmarks.bench_generate --sizes 100 1000 10000 --save-baseline
+    python -m benchmarks.bench_generate --sizes 100 1000 --compare
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from benchmarks.synthetic_export import write_export
+from src.export_archive import get_archive
+from src.exercise_manifest import _find_exercise_csv, _build_manifest
+from src.file_utils import prep_working_dir, get_exercise_files, setup_gpx_folders, save_gpx, get_data_path
+from src.generate_gpx import _merge_data, _make_gpx
+
+BASELINES = Path(__file__).parent / 'baselines.json'
+# NOTE :: A stage is flagged once it's this much slower (or hungrier) than its baseline
+REGRESSION_THRESHOLD = 1.25
+
+
+def bench_size(folder: str, exercises: int, points: int, memory: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Runs every stage once over an export with `exercises` exercises
+
+    :param folder: temp folder to write the export to
+    :param exercises: number of exercises in the export
+    :param points: samples per exercise
+    :param memory: also measure peak memory of each stage (slower)
+    :return: dict of stage -> {seconds, peak_mb}
+    """
+    zip_path = os.path.join(folder, f'bench-{exercises}.zip')
+    if not os.path.isfile(zip_path):
+        write_export(zip_path, exercises, points)
+    get_archive.cache_clear()
+    prep_working_dir(zip_path)
+    archive = get_archive(zip_path)
+    try:
+        results = {}
+        # NOTE :: Parse the CSV directly, build_manifest would only read it once and then use the index
+        manifest = _stage(results, 'build_manifest', memory,
+                          lambda: _build_manifest(archive, _find_exercise_csv(archive)))
+        manifest = {k: v for k, v in manifest.items() if 'unknown' not in k}
+        files = _stage(results, 'get_exercise_files', memory, lambda: get_exercise_files(zip_path, exclude_internal=True))
+        jobs = [(t, i, files.get(i, set())) for t in sorted(manifest) for i in sorted(manifest[t])]
+        _stage(results, '_merge_data', memory, lambda: [_merge_data(archive, f) for _, _, f in jobs])
+        made = _stage(results, '_make_gpx', memory, lambda: [_make_gpx(archive, t, i, f) for t, i, f in jobs])
+        setup_gpx_folders(zip_path, manifest.keys())
+        _stage(results, 'save_gpx', memory,
+               lambda: [save_gpx(zip_path, metadata, track) for metadata, track in made if metadata])
+        return results
+    finally:
+        shutil.rmtree(get_data_path(zip_path), ignore_errors=True)
+
+
+def _stage(results: Dict[str, Dict[str, float]], name: str, memory: bool, run: Callable):
+    """
+    Times one stage (and optionally its peak memory in a second run)
+
+    :return: what the stage returned
+    """
+    start = time.perf_counter()
+    value = run()
+    results[name] = {'seconds': round(time.perf_counter() - start, 4)}
+    if memory:
+        del value
+        tracemalloc.start()
+        value = run()
+        results[name]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return value
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baselines: Dict) -> List[Tuple[str, str, str, float]]:
+    """
+    :param results: size -> stage -> measurements
+    :param baselines: the same shape, from an earlier run
+    :return: list of (size, stage, measurement, ratio) that regressed
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, measurements in stages.items():
+            for key, value in measurements.items():
+                base = baselines.get(size, {}).get(stage, {}).get(key)
+                # NOTE :: Ignore stages too quick to time reliably
+                if base and base > 0.01 and value / base > REGRESSION_THRESHOLD:
+                    regressions.append((size, stage, key, round(value / base, 2)))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of GPX generation on synthetic exports')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='exercises per export')
+    parser.add_argument('--points', type=int, default=600, help='samples per exercise')
+    parser.add_argument('--no-memory', action='store_true', help="skip the (slower) peak memory runs")
+    parser.add_argument('--keep', help='folder to keep the generated exports in between runs')
+    parser.add_argument('--save-baseline', action='store_true', help=f'save the results to {BASELINES.name}')
+    parser.add_argument('--compare', action='store_true', help=f'compare the results to {BASELINES.name}')
+    args = parser.parse_args()
+    folder = args.keep or tempfile.mkdtemp()
+    os.makedirs(folder, exist_ok=True)
+    try:
+        results = {}
+        for size in args.sizes:
+            results[str(size)] = bench_size(folder, size, args.points, memory=not args.no_memory)
+            for stage, measurements in results[str(size)].items():
+                print(f'{size:>6} exercises  {stage:<20} ' + '  '.join(f'{k}={v}' for k, v in measurements.items()))
+    finally:
+        if not args.keep: shutil.rmtree(folder, ignore_errors=True)
+    if args.compare:
+        with open(BASELINES, 'r') as infile:
+            regressions = compare(results, json.load(infile))
+        for size, stage, key, ratio in regressions:
+            print(f'REGRESSION :: {stage} at {size} exercises, {key} is {ratio}x the baseline')
+        if regressions: sys.exit(1)
+    if args.save_baseline:
+        baselines = {}
+        if os.path.isfile(BASELINES):
+            with open(BASELINES, 'r') as infile:
+                baselines = json.load(infile)
+        baselines.update(results)
+        with open(BASELINES, 'w') as outfile:
+            outfile.write(json.dumps(baselines, indent=2, sort_keys=True))
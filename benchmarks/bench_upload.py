@@ -0,0 +1,103 @@
+"""
+Measures upload throughput and quota use against a local fake Strava API.
+
+    python -m benchmarks.bench_upload --count 200 --latency 2 --error-rate 0.05
+"""
+import os
+import time
+import argparse
+import tempfile
+import contextlib
+from requests.adapters import HTTPAdapter
+from stravalib import Client
+from benchmarks.fake_strava import FakeStrava
+from src.rate_limiter import RateLimiter
+from src.upload_activities import _make_client, _upload_files
+from src.constants import STRAVA_UPLOADS_IN_FLIGHT
+
+GPX = (
+    '<?xml version="1.0" encoding="UTF-8"?><gpx creator="StravaGPX" version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+    '<trk><name>Benchmark</name><trkseg><trkpt lat="42.0" lon="-71.0"><time>2020-01-01T00:00:00</time></trkpt>'
+    '</trkseg></trk></gpx>'
+)
+
+
+class PlainHTTPAdapter(HTTPAdapter):
+    """
+    stravalib always builds https:// urls, the fake server only speaks plain http
+    """
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace('https://', 'http://', 1)
+        return super().send(request, **kwargs)
+
+
+def connect(fake: FakeStrava, limiter: RateLimiter) -> Client:
+    """
+    Makes an authorized client that talks to the fake server
+
+    :param fake: running fake Strava API
+    :param limiter: rate limiter fed by the client's responses
+    :return: authorized client
+    """
+    client = _make_client(limiter)
+    client.protocol.server = fake.address
+    client.protocol.rsession.mount(f'https://{fake.address}', PlainHTTPAdapter())
+    client.exchange_code_for_token(client_id=1, client_secret='fake', code='fake')
+    return client
+
+
+def run(count: int, in_flight: int, latency: float, error_rate: float, short_limit: int, daily_limit: int) -> dict:
+    """
+    Uploads `count` small files to a fresh fake server
+
+    :return: dict of measurements
+    """
+    fake = FakeStrava(latency=latency, error_rate=error_rate, short_limit=short_limit, daily_limit=daily_limit).start()
+    uploaded = []
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'benchmark.gpx')
+        with open(path, 'w') as outfile:
+            outfile.write(GPX)
+        files = [(path, {'exercise_id': f'bench-{i}', 'exercise_name': f'Benchmark #{i} (Strava-nator)',
+                         'exercise_type': 'run', 'start_time': f'{i:08d}'}) for i in range(count)]
+        try:
+            limiter = RateLimiter()
+            client = connect(fake, limiter)
+            client.get_athlete()
+            start = time.time()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                _upload_files(files, client, limiter, in_flight,
+                              journal=lambda exercise_id, _, status: status == 'uploaded' and uploaded.append(exercise_id))
+            elapsed = time.time() - start
+            listed = len(list(client.get_activities()))
+        finally:
+            fake.stop()
+    api_calls = fake.calls['upload'] + fake.calls['poll']
+    return {
+        'uploads': len(uploaded),
+        'failed': count - len(uploaded),
+        'seconds': round(elapsed, 2),
+        'uploads_per_minute': round(len(uploaded) / elapsed * 60, 1) if elapsed else None,
+        'api_calls': api_calls,
+        'calls_per_upload': round(api_calls / len(uploaded), 2) if uploaded else None,
+        'rate_limited': fake.calls['rate_limited'],
+        'slept_seconds': round(limiter.slept, 1),
+        'listed_activities': listed,
+    }
+
+
+if __name__ == '__main__':
+    # NOTE :: stravalib warns about missing app credentials, the fake doesn't need any
+    os.environ.setdefault('SILENCE_TOKEN_WARNINGS', 'true')
+    parser = argparse.ArgumentParser(description='Upload throughput against a local fake Strava API')
+    parser.add_argument('--count', type=int, default=100, help='number of activities to upload')
+    parser.add_argument('--in-flight', type=int, default=STRAVA_UPLOADS_IN_FLIGHT)
+    parser.add_argument('--latency', type=float, default=2.0, help='seconds the fake takes to process an upload')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of uploads that fail processing')
+    parser.add_argument('--short-limit', type=int, default=600, help='requests per 15 minutes')
+    parser.add_argument('--daily-limit', type=int, default=30000, help='requests per day')
+    args = parser.parse_args()
+    results = run(args.count, args.in_flight, args.latency, args.error_rate, args.short_limit, args.daily_limit)
+    for key, value in results.items():
+        print(f'{key}: {value}')
@@ -0,0 +1,219 @@
+import re
+import json
+import time
+import random
+import threading
+import datetime
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Tuple
+
+ATHLETE = {'id': 1, 'resource_state': 2, 'firstname': 'Fake', 'lastname': 'Athlete'}
+
+
+class FakeStrava:
+    """
+    Local stand-in for the parts of the Strava API stravalib uses here: token exchange,
+    athlete, uploads (create and poll) and the athlete's activity list. Uploads take
+    `latency` seconds to process, fail `error_rate` of the time and every response carries
+    rate limit headers counted the same way Strava does (15 minute and daily windows).
+    """
+
+    def __init__(self, latency: float = 2.0, error_rate: float = 0.0, short_limit: int = 600,
+                 daily_limit: int = 30000, seed: int = 0, port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.uploads = {}  # type: Dict[int, Dict[str, Any]]
+        self.activities = {}  # type: Dict[int, Dict[str, Any]]
+        self.external_ids = {}  # type: Dict[str, int]
+        self.calls = Counter()
+        self.usage = [0, 0]
+        self._windows = self._current_windows()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self.thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self) -> 'FakeStrava':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count_request(self, endpoint: str) -> bool:
+        """
+        Counts a request against the rate limit windows
+
+        :param endpoint: name of the endpoint for the call counts
+        :return: False if the request is over the limit (and should get a 429)
+        """
+        with self.lock:
+            windows = self._current_windows()
+            if windows[0] != self._windows[0]: self.usage[0] = 0
+            if windows[1] != self._windows[1]: self.usage[1] = 0
+            self._windows = windows
+            self.calls[endpoint] += 1
+            if self.usage[0] >= self.short_limit or self.usage[1] >= self.daily_limit:
+                self.calls['rate_limited'] += 1
+                return False
+            self.usage[0] += 1
+            self.usage[1] += 1
+            return True
+
+    def rate_limit_headers(self) -> Dict[str, str]:
+        return {'X-RateLimit-Limit': f'{self.short_limit},{self.daily_limit}',
+                'X-RateLimit-Usage': f'{self.usage[0]},{self.usage[1]}'}
+
+    def create_upload(self, fields: Dict[str, str]) -> Dict[str, Any]:
+        with self.lock:
+            upload_id = len(self.uploads) + 1
+            external_id = fields.get('external_id')
+            upload = {'id': upload_id, 'id_str': str(upload_id), 'external_id': external_id,
+                      'ready_at': time.time() + self.latency, 'name': fields.get('name'),
+                      'type': (fields.get('activity_type') or 'run').capitalize(),
+                      'fails': self.random.random() < self.error_rate,
+                      'duplicate_of': self.external_ids.get(external_id)}
+            self.uploads[upload_id] = upload
+        return self.upload_status(upload_id)
+
+    def upload_status(self, upload_id: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None: return None
+            response = {'id': upload['id'], 'id_str': upload['id_str'], 'external_id': upload['external_id'],
+                        'error': None, 'status': 'Your activity is still being processed.', 'activity_id': None}
+            if time.time() < upload['ready_at']: return response
+            if upload['duplicate_of']:
+                response['error'] = f"{upload['external_id']} duplicate of activity {upload['duplicate_of']}"
+                response['status'] = 'There was an error processing your activity.'
+            elif upload['fails']:
+                response['error'] = 'Improperly formatted data.'
+                response['status'] = 'There was an error processing your activity.'
+            else:
+                if 'activity_id' not in upload:
+                    upload['activity_id'] = 1000 + upload_id
+                    self.external_ids[upload['external_id']] = upload['activity_id']
+                    self.activities[upload['activity_id']] = _activity(upload)
+                response['activity_id'] = upload['activity_id']
+                response['status'] = 'Your activity is ready.'
+            return response
+
+    def list_activities(self, query: Dict[str, str]) -> list:
+        page = int(query.get('page', 1))
+        per_page = int(query.get('per_page', 30))
+        after = float(query.get('after', 0))
+        with self.lock:
+            activities = [a for a in self.activities.values() if a['_start'] > after]
+        # NOTE :: Like Strava, oldest first when asked for activities after a time and newest first otherwise
+        activities = sorted(activities, key=lambda a: a['_start'], reverse='after' not in query)
+        return [{k: v for k, v in a.items() if k != '_start'}
+                for a in activities[(page - 1) * per_page:page * per_page]]
+
+    @staticmethod
+    def _current_windows() -> Tuple[int, int]:
+        now = time.time()
+        return int(now // (15 * 60)), int(now // (24 * 60 * 60))
+
+
+def _activity(upload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    :param upload: a processed upload
+    :return: the summary activity Strava would list for it
+    """
+    start = upload['ready_at'] - 3600
+    start_date = datetime.datetime.utcfromtimestamp(start).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return {'id': upload['activity_id'], 'resource_state': 2, 'athlete': {'id': ATHLETE['id'], 'resource_state': 1},
+            'name': upload['name'], 'type': upload['type'], 'sport_type': upload['type'],
+            'start_date': start_date, 'start_date_local': start_date, 'elapsed_time': 3600,
+            'moving_time': 3600, 'distance': 10000.0, 'external_id': upload['external_id'], '_start': start}
+
+
+def _handler(fake: FakeStrava):
+    """
+    :param fake: the fake API state the handler serves
+    :return: request handler class bound to it
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == '/api/v3/athlete':
+                self._respond('athlete', lambda: ATHLETE)
+            elif url.path == '/api/v3/athlete/activities':
+                self._respond('activities', lambda: fake.list_activities(query))
+            elif re.fullmatch(r'/api/v3/uploads/\d+', url.path):
+                self._respond('poll', lambda: fake.upload_status(int(url.path.split('/')[-1])))
+            else:
+                self._send(404, {'message': 'Record Not Found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if url.path == '/oauth/token':
+                self._send(200, {'token_type': 'Bearer', 'access_token': 'fake-access', 'refresh_token': 'fake-refresh',
+                                 'expires_at': int(time.time()) + 6 * 3600, 'expires_in': 6 * 3600, 'athlete': ATHLETE})
+            elif url.path == '/api/v3/uploads':
+                # NOTE :: Depending on the stravalib version the fields come in the query string or the form
+                fields = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                fields.update(_multipart_fields(self.headers.get('Content-Type', ''), body))
+                self._respond('upload', lambda: fake.create_upload(fields), status=201)
+            else:
+                self._send(404, {'message': 'Record Not Found'})
+
+        def _respond(self, endpoint: str, make_body, status: int = 200):
+            if not fake.count_request(endpoint):
+                self._send(429, {'message': 'Rate Limit Exceeded',
+                                 'errors': [{'resource': 'Application', 'field': 'rate limit', 'code': 'exceeded'}]})
+                return
+            body = make_body()
+            if body is None:
+                self._send(404, {'message': 'Record Not Found'})
+            else:
+                self._send(status, body)
+
+        def _send(self, status: int, body: Any):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for header, value in fake.rate_limit_headers().items():
+                self.send_header(header, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def _multipart_fields(content_type: str, body: bytes) -> Dict[str, str]:
+    """
+    Pulls the plain form fields out of a multipart upload (the file itself is ignored)
+
+    :param content_type: Content-Type header of the request
+    :param body: raw request body
+    :return: dict of field name -> value
+    """
+    boundary = content_type.split('boundary=')[-1].encode()
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        head, _, value = part.partition(b'\r\n\r\n')
+        match = re.search(rb'name="([^"]+)"', head)
+        if match and b'filename=' not in head:
+            fields[match.group(1).decode()] = value.rstrip(b'\r\n').decode()
+    return fields
@@ -0,0 +1,120 @@
+"""
+Writes a fake Samsung Health export zip shaped like the real ones.
+
+    python -m benchmarks.synthetic_export data/synthetic.zip --exercises 1000 --points 600
+"""
+import json
+import math
+import uuid
+import random
+import zipfile
+import argparse
+import datetime
+
+CSV_NAME = 'com.samsung.shealth.exercise.{stamp}.csv'
+EXERCISE_FOLDER = 'jsons/com.samsung.shealth.exercise'
+CSV_HEADERS = [
+    'com.samsung.health.exercise.start_time', 'com.samsung.health.exercise.end_time',
+    'com.samsung.health.exercise.duration', 'com.samsung.health.exercise.exercise_type',
+    'com.samsung.health.exercise.distance', 'com.samsung.health.exercise.mean_heart_rate',
+    'com.samsung.health.exercise.live_data', 'com.samsung.health.exercise.location_data',
+    'com.samsung.health.exercise.time_offset', 'com.samsung.health.exercise.deviceuuid',
+    'com.samsung.health.exercise.datauuid',
+]
+# NOTE :: exercise type -> (share of exercises, meters per second)
+EXERCISE_TYPES = {'1002': (0.45, 3.0), '11007': (0.3, 7.0), '13001': (0.1, 1.3), '1001': (0.05, 1.5),
+                  '15006': (0.1, 0.0)}
+
+
+def write_export(zip_path: str, exercises: int, points: int = 600, seed: int = 0, nested: bool = True,
+                 location_share: float = 0.85):
+    """
+    Writes the exercise CSV (with its metadata row) and the jsons/*.exercise tree
+
+    :param zip_path: where to write the zip
+    :param exercises: number of exercises
+    :param points: number of 1 second samples per exercise
+    :param seed: seed so the same arguments always make the same export
+    :param nested: put everything under a root folder like the phone does
+    :param location_share: share of exercises that have GPS
+    """
+    rng = random.Random(seed)
+    prefix = 'samsunghealth_synthetic_20200101000000/' if nested else ''
+    start = datetime.datetime(2018, 1, 1, 7, 0, 0)
+    rows = []
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as export:
+        for i in range(exercises):
+            exercise_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            exercise_type = rng.choices(list(EXERCISE_TYPES), [v[0] for v in EXERCISE_TYPES.values()])[0]
+            speed = EXERCISE_TYPES[exercise_type][1]
+            start_time = start + datetime.timedelta(hours=i * 20 + rng.randint(0, 6))
+            start_ms = int(start_time.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+            has_location = speed > 0 and rng.random() < location_share
+            folder = f'{prefix}{EXERCISE_FOLDER}/{exercise_id[0]}/{exercise_id}'
+            live_name = f'{exercise_id}.com.samsung.health.exercise.live_data.json'
+            location_name = f'{exercise_id}.com.samsung.health.exercise.location_data.json'
+            export.writestr(f'{folder}.com.samsung.health.exercise.live_data.json',
+                            json.dumps(_live_data(rng, start_ms, points, speed)))
+            export.writestr(f'{folder}.com.samsung.health.exercise.live_data_internal.json',
+                            json.dumps([{'start_time': start_ms, 'segment': 1}]))
+            if has_location:
+                export.writestr(f'{folder}.com.samsung.health.exercise.location_data.json',
+                                json.dumps(_location_data(rng, start_ms, points, speed)))
+            end_time = start_time + datetime.timedelta(seconds=points)
+            rows.append([start_time.strftime('%Y-%m-%d %H:%M:%S.000'), end_time.strftime('%Y-%m-%d %H:%M:%S.000'),
+                         str(points * 1000), exercise_type, f'{speed * points:.1f}', f'{rng.uniform(110, 160):.1f}',
+                         live_name, location_name if has_location else '', 'UTC-0500', 'synthetic-device',
+                         exercise_id])
+        stamp = start.strftime('%Y%m%d%H%M%S')
+        lines = [f'com.samsung.shealth.exercise,6302002,{len(CSV_HEADERS)}', ','.join(CSV_HEADERS) + ',']
+        lines.extend(','.join(row) + ',' for row in rows)
+        export.writestr(f'{prefix}{CSV_NAME.format(stamp=stamp)}', '\n'.join(lines) + '\n')
+        export.writestr(f'{prefix}com.samsung.shealth.exercise.pacesetter.{stamp}.csv', 'pacesetter,1,1\n')
+
+
+def _location_data(rng: random.Random, start_ms: int, points: int, speed: float) -> list:
+    """
+    A wandering track with a few stops, sampled roughly every second
+    """
+    samples = []
+    latitude, longitude, altitude = rng.uniform(42.2, 42.5), rng.uniform(-71.3, -70.9), rng.uniform(5, 60)
+    heading = rng.uniform(0, 2 * math.pi)
+    for s in range(points):
+        stopped = (s // 120) % 5 == 4 and s % 120 < 30
+        if not stopped:
+            heading += rng.gauss(0, 0.1)
+            latitude += math.cos(heading) * speed / 111111
+            longitude += math.sin(heading) * speed / (111111 * math.cos(math.radians(latitude)))
+            altitude += rng.gauss(0, 0.3)
+        samples.append({'start_time': start_ms + s * 1000 + rng.randint(0, 400), 'latitude': round(latitude, 7),
+                        'longitude': round(longitude, 7), 'altitude': round(altitude, 1),
+                        'accuracy': round(rng.uniform(3, 12), 1)})
+    return samples
+
+
+def _live_data(rng: random.Random, start_ms: int, points: int, speed: float) -> list:
+    """
+    Heart rate and cadence (plus the speed and distance fields we ignore) every second
+    """
+    samples = []
+    heart_rate = rng.uniform(90, 110)
+    for s in range(points):
+        heart_rate = min(185.0, max(80.0, heart_rate + rng.gauss(0.05, 1.5)))
+        sample = {'start_time': start_ms + s * 1000 + rng.randint(0, 600), 'heart_rate': float(round(heart_rate)),
+                  'speed': round(speed * rng.uniform(0.8, 1.2), 2), 'distance': round(speed * s, 1)}
+        if speed:
+            sample['cadence'] = float(rng.randint(75, 92))
+        samples.append(sample)
+    return samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic Samsung Health export zip')
+    parser.add_argument('zip_path')
+    parser.add_argument('--exercises', type=int, default=100)
+    parser.add_argument('--points', type=int, default=600, help='samples per exercise')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flat', action='store_true', help="don't nest everything under a root folder")
+    args = parser.parse_args()
+    write_export(args.zip_path, args.exercises, args.points, args.seed, nested=not args.flat)
+    print(f'Wrote {args.exercises} exercises to {args.zip_path}')
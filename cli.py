@@ -1,33 +1,143 @@
 import sys
-from src.file_utils import prep_working_dir
+import time
+import cProfile
+import argparse
+import datetime
+from src import metrics
+from src.file_utils import prep_working_dir, find_exports
 from src.investigate_files import investigate
+from src.export_changes import report_export_changes
+from src.exercise_stats import print_stats
+from src.exercise_filter import ExerciseFilter
 from src.exercise_manifest import build_manifest
 from src.generate_gpx import generate_gpx_files
-from src.upload_activities import upload_new_gpx
+from src.constants import STRAVA_UPLOADS_IN_FLIGHT, WATCH_INTERVAL
 
-SUPPORTED_METHODS = ['investigate', 'manifest', 'generate', 'upload']
+SUPPORTED_METHODS = ['investigate', 'manifest', 'generate', 'stats', 'upload', 'sync', 'watch']
+
+
+def _parse_args() -> argparse.Namespace:
+    """
+    Parses the method, zip path and any options from the command line
+    """
+    parser = argparse.ArgumentParser(description='Format and upload Samsung Health exercise data to Strava')
+    parser.add_argument('method', type=str.lower, choices=SUPPORTED_METHODS)
+    parser.add_argument('file_paths', nargs='+', metavar='file_path',
+                        help='path to the zip file of your samsung data, several of them or a folder of them')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to scan or generate files with (default: 1)')
+    parser.add_argument('--gzip', action='store_true', help='generate compressed .gpx.gz (or .fit.gz) files')
+    parser.add_argument('--fit', action='store_true', help='generate FIT files, which are much smaller than GPX')
+    parser.add_argument('--simplify', type=float, metavar='METERS',
+                        help='drop points that are within METERS of the simplified route (and repeats while stopped)')
+    parser.add_argument('--in-flight', type=int, default=STRAVA_UPLOADS_IN_FLIGHT,
+                        help=f'max uploads processing on Strava at once (default: {STRAVA_UPLOADS_IN_FLIGHT})')
+    parser.add_argument('--no-save', dest='save', action='store_false',
+                        help='with sync or watch, upload the files straight from memory instead of also saving them')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, metavar='SECONDS',
+                        help=f'with watch, how often to look for new exports (default: {WATCH_INTERVAL})')
+    parser.add_argument('--since', type=_date, metavar='YYYY-MM-DD',
+                        help='only exercises that started on or after this day (UTC)')
+    parser.add_argument('--until', type=_date, metavar='YYYY-MM-DD',
+                        help='only exercises that started on or before this day (UTC)')
+    parser.add_argument('--type', dest='types', action='append', metavar='TYPE',
+                        help='only exercises of this type (run, ride, hike...), can be given more than once')
+    parser.add_argument('--yes', action='store_true',
+                        help="upload without asking for confirmation (needs a saved authorization, e.g. for cron)")
+    parser.add_argument('--profile', action='store_true', help='print the time and counts of each stage at the end')
+    parser.add_argument('--metrics', metavar='FILE', help='save the time and counts of each stage to a JSON file')
+    parser.add_argument('--pstats', metavar='FILE',
+                        help='save a cProfile of the run (main process only) to open with pstats or snakeviz')
+    return parser.parse_args()
+
+
+def _date(value: str) -> datetime.date:
+    """
+    :param value: a day from the command line
+    :return: the parsed date
+    """
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a date like 2020-01-31')
+
+
+def _extension(args: argparse.Namespace) -> str:
+    """
+    :param args: parsed command line
+    :return: kind of file to generate, one of ACTIVITY_FILE_TYPES
+    """
+    return ('.fit' if args.fit else '.gpx') + ('.gz' if args.gzip else '')
+
+
+def _run(args: argparse.Namespace):
+    """
+    Runs the method asked for
+
+    :param args: parsed command line
+    """
+    method = args.method
+    types = frozenset(t.lower() for t in args.types) if args.types else None
+    exercise_filter = ExerciseFilter(args.since, args.until, types)
+    if method == 'watch':
+        # NOTE :: The folder may still be empty, the watcher finds and prepares the zips as they land
+        from src.upload_activities import watch_new_exports
+        watch_new_exports(args.file_paths, interval=args.interval, workers=args.workers, extension=_extension(args),
+                          tolerance=args.simplify, exercise_filter=exercise_filter, in_flight=args.in_flight,
+                          yes=args.yes, save=args.save)
+        return
+    file_paths = find_exports(args.file_paths)
+    with metrics.stage('prep_working_dir'):
+        for file_path in file_paths:
+            prep_working_dir(file_path)
+            report_export_changes(file_path)
+    if method == 'investigate':
+        for file_path in file_paths:
+            if len(file_paths) > 1: print(f'Investigating {file_path}')
+            investigate(file_path, workers=args.workers)
+    elif method == 'manifest':
+        for file_path in file_paths:
+            manifest = build_manifest(file_path, exercise_filter=exercise_filter)
+            print(f'Found these exercises to be imported from {file_path}: '
+                  f'{[(key, len(value)) for key, value in manifest.items()]}')
+        print('NOTE :: Not all of these will have enough GPS points to upload to Strava')
+    elif method == 'generate':
+        generate_gpx_files(file_paths, workers=args.workers, extension=_extension(args), tolerance=args.simplify,
+                           exercise_filter=exercise_filter)
+    elif method == 'stats':
+        print_stats(file_paths, exercise_filter)
+    elif method == 'upload':
+        # NOTE :: stravalib (and Flask, if we need to authorize) are only imported for uploads
+        from src.upload_activities import upload_new_gpx
+        upload_new_gpx(file_paths, in_flight=args.in_flight, yes=args.yes, exercise_filter=exercise_filter)
+    elif method == 'sync':
+        from src.upload_activities import sync_new_exercises
+        sync_new_exercises(file_paths, workers=args.workers, extension=_extension(args), tolerance=args.simplify,
+                           exercise_filter=exercise_filter, in_flight=args.in_flight, yes=args.yes, save=args.save)
 
 
 if __name__ == '__main__':
     if len(sys.argv) == 2 and sys.argv[1].lower() == 'help':
         print(f'Use one of these methods as the first arg: {SUPPORTED_METHODS}')
-        print('Followed by the path to the zip file of your samsung data')
-    elif len(sys.argv) == 3:
-        method = sys.argv[1].lower()
-        file_path = sys.argv[2]
-        if method not in SUPPORTED_METHODS:
-            raise Exception(f'{method} is not a supported method ({SUPPORTED_METHODS})!')
-        else:
-            prep_working_dir(file_path)
-        if method == 'investigate':
-            investigate(file_path)
-        elif method == 'manifest':
-            manifest = build_manifest(file_path)
-            print(f'Found these exercises to be imported: {[(key, len(value)) for key, value in manifest.items()]}')
-            print('NOTE :: Not all of these will have enough GPS points to upload to Strava')
-        elif method == 'generate':
-            generate_gpx_files(file_path)
-        elif method == 'upload':
-            upload_new_gpx(file_path)
+        print('Followed by the path to the zip file of your samsung data (or several, or a folder of them)')
+        print('Add --workers N to generate with N processes, --fit to write FIT files or --gzip to compress them')
+        print('Add --yes to upload without any prompts once you have authorized with Strava')
+        print('Use sync to generate and upload in one go, add --no-save to upload without writing the files')
+        print('Use watch with a folder to sync every new export that lands in it, --interval N to look every N seconds')
+        print('Add --since YYYY-MM-DD, --until YYYY-MM-DD or --type ride to only work on some of your exercises')
+        print('Add --profile to print how long each stage took or --metrics <file> to save it as JSON')
     else:
-        raise Exception(f'Unkown args: {sys.argv[1:]}')
+        args = _parse_args()
+        start = time.perf_counter()
+        profiler = cProfile.Profile() if args.pstats else None
+        try:
+            if profiler: profiler.enable()
+            _run(args)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.pstats)
+            if args.profile: metrics.print_metrics()
+            if args.metrics:
+                metrics.save_metrics(args.metrics, method=args.method, file_paths=args.file_paths,
+                                     total_seconds=round(time.perf_counter() - start, 4))
@@ -0,0 +1,357 @@
+import os
+import glob
+import json
+import sqlite3
+import datetime
+import threading
+from pathlib import Path
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.file_utils import get_data_path, get_data_root
+from src.exercise_filter import ExerciseFilter, NO_FILTER
+from src.constants import STRAVANATOR_FOLDER, STRAVANATOR_UPLOADED, STRAVANATOR_INDEX
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS exercises (
+    export TEXT NOT NULL,
+    exercise_id TEXT NOT NULL,
+    exercise_type TEXT NOT NULL,
+    fingerprint TEXT,
+    gpx_file TEXT,
+    start_time TEXT,
+    metadata TEXT,
+    PRIMARY KEY (export, exercise_id)
+);
+CREATE INDEX IF NOT EXISTS exercises_by_start_time ON exercises (export, start_time);
+CREATE INDEX IF NOT EXISTS exercises_by_fingerprint ON exercises (exercise_id, fingerprint);
+CREATE TABLE IF NOT EXISTS uploads (
+    exercise_id TEXT PRIMARY KEY,
+    uploaded_at TEXT
+);
+CREATE TABLE IF NOT EXISTS imports (
+    export TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS upload_journal (
+    exercise_id TEXT PRIMARY KEY,
+    upload_id INTEGER NOT NULL,
+    submitted_at TEXT
+);
+CREATE TABLE IF NOT EXISTS strava_activities (
+    activity_id INTEGER PRIMARY KEY,
+    start_time REAL NOT NULL,
+    elapsed_time REAL NOT NULL,
+    activity_type TEXT,
+    external_id TEXT
+);
+CREATE INDEX IF NOT EXISTS strava_activities_by_start_time ON strava_activities (start_time);
+CREATE TABLE IF NOT EXISTS export_members (
+    export TEXT NOT NULL,
+    name TEXT NOT NULL,
+    crc INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (export, name)
+);
+CREATE TABLE IF NOT EXISTS manifests (
+    export TEXT PRIMARY KEY,
+    csv_key TEXT NOT NULL,
+    manifest TEXT NOT NULL
+);
+'''
+
+
+def get_index() -> sqlite3.Connection:
+    """
+    Opens the local index of exercises and uploads shared by every export in the data folder
+
+    :return: sqlite connection for the calling thread
+    """
+    # NOTE :: sqlite connections can't be shared between threads and sync generates and uploads in different ones
+    return _connect(threading.get_ident())
+
+
+@lru_cache(maxsize=None)
+def _connect(thread_id: int) -> sqlite3.Connection:
+    """
+    :param thread_id: thread the connection is for
+    :return: sqlite connection
+    """
+    db = sqlite3.connect(str(get_data_root() / STRAVANATOR_INDEX))
+    db.executescript(SCHEMA)
+    return db
+
+
+def get_generation_state(file_path: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Gets what was generated for each exercise in this export the last time around
+
+    :param file_path: path to zip
+    :return: dict of exercise id -> (fingerprint, gpx file or None if there was nothing to generate)
+    """
+    export = _import_legacy_files(file_path)
+    rows = get_index().execute('SELECT exercise_id, fingerprint, gpx_file FROM exercises WHERE export = ?', (export,))
+    return {exercise_id: (fingerprint, gpx_file) for exercise_id, fingerprint, gpx_file in rows}
+
+
+def record_generation(file_path: str, exercise_type: str, exercise_id: str, fingerprint: str,
+                      gpx_metadata: Optional[Dict[str, str]], gpx_path: Optional[str]):
+    """
+    Saves what was generated for an exercise. Call save_index() to commit.
+
+    :param file_path: path to zip
+    :param exercise_type: the type of exercise
+    :param exercise_id: id of the exercise
+    :param fingerprint: fingerprint of the exercise's files
+    :param gpx_metadata: metadata for the gpx file (None if nothing was generated)
+    :param gpx_path: path to the gpx file (None if nothing was generated)
+    """
+    export = get_data_path(file_path).name
+    gpx_file = str(Path(gpx_path).relative_to(get_data_root())) if gpx_path else None
+    get_index().execute(
+        'INSERT OR REPLACE INTO exercises VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (export, exercise_id, exercise_type, fingerprint, gpx_file,
+         gpx_metadata['start_time'] if gpx_metadata else None, json.dumps(gpx_metadata) if gpx_metadata else None)
+    )
+
+
+def find_generated_copy(exercise_id: str, fingerprint: str) -> Optional[Tuple[Optional[str], Optional[Dict[str, str]]]]:
+    """
+    Finds an exercise that was already generated from the exact same files in any export
+
+    :param exercise_id: id of the exercise
+    :param fingerprint: fingerprint of the exercise's files
+    :return: (gpx file relative to the data folder, gpx_metadata) or (None, None) if there was nothing
+    to generate, None if it was never generated from these files
+    """
+    rows = get_index().execute('SELECT gpx_file, metadata FROM exercises WHERE exercise_id = ? AND fingerprint = ?',
+                               (exercise_id, fingerprint))
+    for gpx_file, metadata in rows:
+        if gpx_file is None: return None, None
+        if os.path.isfile(get_data_root() / gpx_file): return gpx_file, json.loads(metadata)
+    return None
+
+
+def get_cached_manifest(file_path: str, csv_key: str) -> Optional[Dict[str, Dict[str, str]]]:
+    """
+    Gets the manifest parsed from this export's exercise CSV the last time around
+
+    :param file_path: path to zip
+    :param csv_key: identifies the exact CSV the manifest was parsed from
+    :return: dict of exercise type to a dict of id -> start time or None if the CSV has changed (or was never parsed)
+    """
+    export = get_data_path(file_path).name
+    row = get_index().execute('SELECT manifest FROM manifests WHERE export = ? AND csv_key = ?',
+                              (export, csv_key)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_manifest(file_path: str, csv_key: str, manifest: Dict[str, Dict[str, str]]):
+    """
+    Saves the manifest parsed from this export's exercise CSV
+
+    :param file_path: path to zip
+    :param csv_key: identifies the exact CSV the manifest was parsed from
+    :param manifest: dict of exercise type to a dict of id -> start time
+    """
+    export = get_data_path(file_path).name
+    db = get_index()
+    db.execute('INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)', (export, csv_key, json.dumps(manifest)))
+    db.commit()
+
+
+def get_export_members(file_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Gets the zip directory of this export as it was the last time around
+
+    :param file_path: path to zip
+    :return: dict of member name -> (CRC, size), empty if the export has never been seen
+    """
+    export = get_data_path(file_path).name
+    rows = get_index().execute('SELECT name, crc, size FROM export_members WHERE export = ?', (export,))
+    return {name: (crc, size) for name, crc, size in rows}
+
+
+def save_export_members(file_path: str, members: Dict[str, Tuple[int, int]]):
+    """
+    Replaces the saved zip directory of this export
+
+    :param file_path: path to zip
+    :param members: dict of member name -> (CRC, size)
+    """
+    export = get_data_path(file_path).name
+    db = get_index()
+    db.execute('DELETE FROM export_members WHERE export = ?', (export,))
+    db.executemany('INSERT INTO export_members VALUES (?, ?, ?, ?)',
+                   [(export, name, crc, size) for name, (crc, size) in members.items()])
+    db.commit()
+
+
+def save_index():
+    """
+    Commits anything recorded in the index
+    """
+    get_index().commit()
+
+
+def get_upload_files(file_paths: List[str],
+                     exercise_filter: ExerciseFilter = NO_FILTER) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Get the files that need to be uploaded that are new. When an exercise is in more than one
+    export only the copy from the newest export counts.
+
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param exercise_filter: which exercises to look at
+    :return: list of (path, gpx_metadata) sorted by start_time
+    """
+    newest = _newest_copies(file_paths, exercise_filter, only_new=True)
+    files = [(str(get_data_root() / gpx_file), json.loads(metadata))
+             for gpx_file, metadata in newest.values() if gpx_file is not None]
+    return sorted(files, key=lambda f: f[1]['start_time'])
+
+
+def get_generated_metadata(file_paths: List[str], exercise_filter: ExerciseFilter = NO_FILTER) -> List[Dict[str, Any]]:
+    """
+    Gets the gpx_metadata (with its stats) of every exercise a file was generated for, without opening the files
+
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param exercise_filter: which exercises to look at
+    :return: list of gpx_metadata, the newest copy of each exercise
+    """
+    newest = _newest_copies(file_paths, exercise_filter)
+    return [json.loads(metadata) for gpx_file, metadata in newest.values() if gpx_file is not None]
+
+
+def _newest_copies(file_paths: List[str], exercise_filter: ExerciseFilter,
+                   only_new: bool = False) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param exercise_filter: which exercises to look at, applied in the query so nothing else is read
+    :param only_new: leave out exercises that have been uploaded
+    :return: dict of exercise id -> (gpx file, metadata JSON) from the newest export with the exercise
+    """
+    query = 'SELECT e.exercise_id, e.gpx_file, e.metadata FROM exercises e '
+    if only_new: query += 'LEFT JOIN uploads u ON u.exercise_id = e.exercise_id '
+    query += 'WHERE e.export = ?'
+    params = []
+    if only_new: query += ' AND u.exercise_id IS NULL'
+    if exercise_filter.since is not None:
+        query += ' AND e.start_time >= ?'
+        params.append(exercise_filter.since.isoformat())
+    if exercise_filter.until is not None:
+        # NOTE :: start_time is an ISO timestamp so everything on the until date sorts before the next day
+        query += ' AND e.start_time < ?'
+        params.append((exercise_filter.until + datetime.timedelta(days=1)).isoformat())
+    if exercise_filter.types is not None:
+        query += f' AND e.exercise_type IN ({", ".join("?" for _ in exercise_filter.types)})'
+        params.extend(sorted(exercise_filter.types))
+    newest = {}
+    for file_path in file_paths:
+        export = _import_legacy_files(file_path)
+        for exercise_id, gpx_file, metadata in get_index().execute(query, (export, *params)):
+            newest[exercise_id] = (gpx_file, metadata)
+    return newest
+
+
+def get_uploaded_ids() -> Set[str]:
+    """
+    :return: ids of every exercise that's been uploaded
+    """
+    return {exercise_id for exercise_id, in get_index().execute('SELECT exercise_id FROM uploads')}
+
+
+def mark_uploaded(exercise_id: str):
+    """
+    Save a file as uploaded
+
+    :param exercise_id: id of uploaded file
+    """
+    db = get_index()
+    db.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?)',
+               (exercise_id, datetime.datetime.utcnow().isoformat()))
+    db.execute('DELETE FROM upload_journal WHERE exercise_id = ?', (exercise_id,))
+    db.commit()
+
+
+def journal_upload(exercise_id: str, upload_id: Optional[int], status: str):
+    """
+    Write-ahead journal of uploads Strava is still processing. An upload is journaled (and
+    committed) as soon as Strava hands back its id so a crashed run can pick it up again.
+
+    :param exercise_id: id of the exercise being uploaded
+    :param upload_id: Strava's id for the upload
+    :param status: 'submitted' when Strava accepted the file, 'uploaded' once it's an activity
+    (or already was one) and 'failed' if Strava rejected it
+    """
+    if status == 'uploaded':
+        mark_uploaded(exercise_id)
+        return
+    db = get_index()
+    if status == 'submitted':
+        db.execute('INSERT OR REPLACE INTO upload_journal VALUES (?, ?, ?)',
+                   (exercise_id, upload_id, datetime.datetime.utcnow().isoformat()))
+    else:
+        db.execute('DELETE FROM upload_journal WHERE exercise_id = ?', (exercise_id,))
+    db.commit()
+
+
+def get_upload_journal() -> Dict[str, int]:
+    """
+    :return: dict of exercise id -> upload id for every upload that was still processing when a run stopped
+    """
+    return dict(get_index().execute('SELECT exercise_id, upload_id FROM upload_journal'))
+
+
+def get_strava_activities() -> List[Tuple[float, float, str, int]]:
+    """
+    :return: list of (start time, elapsed time, type, activity id) of the athlete's Strava activities
+    sorted by start time (epoch seconds)
+    """
+    return get_index().execute('SELECT start_time, elapsed_time, activity_type, activity_id '
+                               'FROM strava_activities ORDER BY start_time').fetchall()
+
+
+def get_latest_strava_activity() -> Optional[float]:
+    """
+    :return: start time (epoch seconds) of the newest cached Strava activity, None if nothing is cached
+    """
+    return get_index().execute('SELECT MAX(start_time) FROM strava_activities').fetchone()[0]
+
+
+def save_strava_activities(activities: List[Tuple[int, float, float, str, Optional[str]]]):
+    """
+    Adds to the cache of the athlete's Strava activities
+
+    :param activities: list of (activity id, start time, elapsed time, type, external id)
+    """
+    db = get_index()
+    db.executemany('INSERT OR REPLACE INTO strava_activities VALUES (?, ?, ?, ?, ?)', activities)
+    db.commit()
+
+
+def _import_legacy_files(file_path: str) -> str:
+    """
+    Pulls the already_uploaded.txt and per-file JSON metadata written by older versions
+    into the index. Only happens once per export.
+
+    :param file_path: path to zip
+    :return: name of the export in the index
+    """
+    data_path = get_data_path(file_path)
+    export = data_path.name
+    db = get_index()
+    if db.execute('SELECT 1 FROM imports WHERE export = ?', (export,)).fetchone(): return export
+    root_folder = Path(data_path) / STRAVANATOR_FOLDER
+    for metadata_file in glob.glob(str(root_folder / '*' / '*.json')):
+        gpx_path = f'{metadata_file[:-len(".json")]}.gpx'
+        if not os.path.isfile(gpx_path): continue
+        with open(metadata_file, 'r') as infile:
+            gpx_metadata = json.load(infile)
+        # NOTE :: No fingerprint so the next generate rebuilds it once and records what it was built from
+        record_generation(file_path, gpx_metadata['exercise_type'], gpx_metadata['exercise_id'],
+                          None, gpx_metadata, gpx_path)
+    if os.path.isfile(root_folder / STRAVANATOR_UPLOADED):
+        with open(root_folder / STRAVANATOR_UPLOADED, 'r') as infile:
+            uploaded = set([f.strip() for f in infile.readlines() if f.strip()])
+        db.executemany('INSERT OR IGNORE INTO uploads VALUES (?, NULL)', [(f,) for f in uploaded])
+    db.execute('INSERT INTO imports VALUES (?)', (export,))
+    db.commit()
+    return export
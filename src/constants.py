@@ -6,7 +6,41 @@ SAMSUNG_EXERCISE_MAPPINGS = {
 }
 SAMSUNG_EXERCISE_TYPE_HEADER = 'com.samsung.health.exercise.exercise_type'
 SAMSUNG_LOCATION_DATA_HEADER = 'com.samsung.health.exercise.location_data'
+SAMSUNG_START_TIME_HEADER = 'com.samsung.health.exercise.start_time'
 STRAVANATOR_FOLDER = 'stravanator'
 STRAVANATOR_UPLOADED = 'already_uploaded.txt'
+STRAVANATOR_INDEX = 'stravanator.db'
+# NOTE :: Bump this whenever the generated files change so cached exercises get rebuilt
+STRAVANATOR_GENERATOR_VERSION = 4
+# NOTE :: Most seconds between points left in a simplified track
+SIMPLIFY_MAX_GAP = 10
 STRAVA_RATE_LIMIT = 100
+STRAVA_DAILY_RATE_LIMIT = 1000
 STRAVA_RATE_INTERVAL = 15
+STRAVA_UPLOADS_IN_FLIGHT = 5
+# NOTE :: Most built files sync keeps waiting for the uploader, so memory stays flat however many there are
+SYNC_QUEUE_DEPTH = 10
+# NOTE :: Seconds between looks for new exports in watch mode
+WATCH_INTERVAL = 60
+STRAVA_TOKEN_FILE = 'strava_tokens.json'
+# NOTE :: Refresh the access token if it expires within this many seconds
+STRAVA_TOKEN_REFRESH_MARGIN = 30 * 60
+# NOTE :: Seconds to give Strava before checking on an upload
+STRAVA_POLL_INTERVAL = 5
+# NOTE :: Most activities Strava will list per request
+STRAVA_ACTIVITIES_PER_PAGE = 200
+# NOTE :: Seconds either side of the start time to match on when we don't know when an exercise ended
+STRAVA_MATCH_WINDOW = 60
+# NOTE :: Extension of each kind of activity file we write -> Strava upload data_type
+ACTIVITY_FILE_TYPES = {
+    '.gpx': 'gpx',
+    '.gpx.gz': 'gpx.gz',
+    '.fit': 'fit',
+    '.fit.gz': 'fit.gz'
+}
+# NOTE :: Exercise type -> FIT sport (anything else is generic)
+FIT_SPORTS = {
+    'run': 1,
+    'ride': 2,
+    'hike': 17
+}
@@ -0,0 +1,32 @@
+import datetime
+from typing import NamedTuple, Optional, FrozenSet
+
+
+class ExerciseFilter(NamedTuple):
+    """
+    Which exercises to work on. Dates are compared against the UTC start time and None means no limit.
+    """
+    since: Optional[datetime.date] = None
+    until: Optional[datetime.date] = None
+    types: Optional[FrozenSet[str]] = None
+
+    def matches(self, exercise_type: str, start_time: str) -> bool:
+        """
+        :param exercise_type: the type of exercise (run, ride...)
+        :param start_time: when it started, anything that begins with an ISO date (YYYY-MM-DD)
+        :return: True if the exercise should be worked on
+        """
+        if self.types is not None and exercise_type not in self.types: return False
+        date = start_time[:10]
+        if self.since is not None and not date >= self.since.isoformat(): return False
+        if self.until is not None and not date <= self.until.isoformat(): return False
+        return True
+
+    def is_empty(self) -> bool:
+        """
+        :return: True if every exercise matches
+        """
+        return self.since is None and self.until is None and self.types is None
+
+
+NO_FILTER = ExerciseFilter()
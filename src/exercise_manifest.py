@@ -1,63 +1,101 @@
+import io
 import csv
-import glob
-from pathlib import Path
-from typing import Dict, Set
+from typing import Dict
 from collections import defaultdict
-from src.file_utils import get_data_path
-from src.constants import SAMSUNG_EXERCISE_MAPPINGS, SAMSUNG_EXERCISE_TYPE_HEADER, SAMSUNG_LOCATION_DATA_HEADER
+from src.export_archive import ExportArchive, get_archive
+from src.metrics import timed, count
+from src.activity_index import get_cached_manifest, save_manifest
+from src.exercise_filter import ExerciseFilter, NO_FILTER
+from src.constants import SAMSUNG_EXERCISE_MAPPINGS, SAMSUNG_EXERCISE_TYPE_HEADER, SAMSUNG_LOCATION_DATA_HEADER, \
+    SAMSUNG_START_TIME_HEADER
 
 
-def build_manifest(file_path: str, skip_unknown: bool = False) -> Dict[str, Set[str]]:
+@timed('build_manifest')
+def build_manifest(file_path: str, skip_unknown: bool = False,
+                   exercise_filter: ExerciseFilter = NO_FILTER) -> Dict[str, Dict[str, str]]:
     """
     Uses the provided exercise CSV to get a manifest of exercises and their file_ids.
+    The parsed manifest is kept in the index so the CSV is only read again when it changes.
 
     :param file_path: path to zip file
     :param skip_unknown: whether or not to exclude known exercises
-    :return: dict of exercise to a set of ids to identify relevant files
+    :param exercise_filter: only include these exercises (by type and the start time in the CSV)
+    :return: dict of exercise to a dict of ids to identify relevant files -> start time (UTC, as written in the CSV)
     """
-    data_path = get_data_path(file_path)
-    exercise_csv = _find_exercise_csv(data_path)
-    manifest = _build_manifest(exercise_csv)
+    archive = get_archive(file_path)
+    exercise_csv = _find_exercise_csv(archive)
+    csv_key = _csv_key(archive, exercise_csv)
+    manifest = get_cached_manifest(file_path, csv_key)
+    if manifest is None:
+        manifest = _build_manifest(archive, exercise_csv)
+        save_manifest(file_path, csv_key, manifest)
     if skip_unknown: manifest = {k: v for k, v in manifest.items() if 'unknown' not in k}
-    return manifest
+    if exercise_filter.is_empty(): return manifest
+    selected = {}
+    for exercise_type, start_times in manifest.items():
+        ids = {i: start_time for i, start_time in start_times.items()
+               if exercise_filter.matches(exercise_type, start_time)}
+        if ids: selected[exercise_type] = ids
+    return selected
 
 
-def _find_exercise_csv(data_path: str) -> str:
+def _find_exercise_csv(archive: ExportArchive) -> str:
     """
     Find CSV enumerating the exercises
 
-    :param data_path: path to relative data folder
-    :return: path to the CSV
+    :param archive: the opened export
+    :return: name of the CSV in the export
     """
-    for path in glob.glob(str(Path(data_path) / '*.csv')):
+    for path in archive.namelist():
+        if '/' in path or not path.endswith('.csv'): continue
         if '.exercise.' in path and 'pacesetter' not in path:
             return path
     raise Exception('Cannot locate file with all exercise info')
 
 
-def _build_manifest(csv_path: str) -> Dict[str, Set[str]]:
+def _csv_key(archive: ExportArchive, csv_path: str) -> str:
+    """
+    :param archive: the opened export
+    :param csv_path: name of the exercise csv in the export
+    :return: key that changes whenever the CSV does (its name, size, modified time and CRC in the zip)
+    """
+    info = archive.getinfo(csv_path)
+    modified = '-'.join(str(v) for v in info.date_time)
+    return f'{csv_path}:{info.file_size}:{modified}:{info.CRC}'
+
+
+def _build_manifest(archive: ExportArchive, csv_path: str) -> Dict[str, Dict[str, str]]:
     """
     Parses CSV and find exercises with location data
 
-    :param csv_path: path to exercise csv
-    :return: dict of exercise type to ids
+    :param archive: the opened export
+    :param csv_path: name of the exercise csv in the export
+    :return: dict of exercise type to a dict of id -> start time (UTC, as written in the CSV)
     """
-    exercises = defaultdict(set)
-    # NOTE :: SHealth CSV has weird first row with some metadata
-    skipped_metadata = False
-    headers = None
-    with open(csv_path, 'r') as infile:
+    exercises = defaultdict(dict)
+    count('build_manifest', bytes_read=archive.getinfo(csv_path).file_size)
+    with io.TextIOWrapper(archive.open(csv_path), encoding='utf-8', newline='') as infile:
         reader = csv.reader(infile)
+        # NOTE :: SHealth CSV has weird first row with some metadata
+        next(reader, None)
+        headers = [h.lower() for h in next(reader, [])]
+        if SAMSUNG_LOCATION_DATA_HEADER not in headers or SAMSUNG_EXERCISE_TYPE_HEADER not in headers:
+            return exercises
+        # NOTE :: Resolve the columns we need once instead of building a dict for every row
+        location_column = headers.index(SAMSUNG_LOCATION_DATA_HEADER)
+        type_column = headers.index(SAMSUNG_EXERCISE_TYPE_HEADER)
+        start_column = headers.index(SAMSUNG_START_TIME_HEADER) if SAMSUNG_START_TIME_HEADER in headers else None
+        width = max(location_column, type_column) + 1
+        rows = 0
         for row in reader:
-            if not skipped_metadata:
-                skipped_metadata = True
-            elif headers is None:
-                headers = row
-            else:
-                row = {headers[i].lower(): row[i] for i in range(len(headers))}
-                location_data = row.get(SAMSUNG_LOCATION_DATA_HEADER)
-                exercise_type = row.get(SAMSUNG_EXERCISE_TYPE_HEADER)
-                if location_data and exercise_type:
-                    file_id = location_data.split('.')[0]
-                    exercises[SAMSUNG_EXERCISE_MAPPINGS.get(exercise_type, f'unknown-{exercise_type}')].add(file_id)
+            rows += 1
+            if len(row) < width: continue
+            location_data = row[location_column]
+            exercise_type = row[type_column]
+            if location_data and exercise_type:
+                file_id = location_data.split('.')[0]
+                start_time = row[start_column] if start_column is not None and start_column < len(row) else ''
+                exercise_type = SAMSUNG_EXERCISE_MAPPINGS.get(exercise_type, f'unknown-{exercise_type}')
+                exercises[exercise_type][file_id] = start_time
+        count('build_manifest', points=rows)
     return exercises
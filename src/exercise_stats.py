@@ -0,0 +1,59 @@
+from collections import defaultdict
+from typing import Any, Dict, List
+from src.activity_index import get_generated_metadata
+from src.exercise_filter import ExerciseFilter, NO_FILTER
+
+# NOTE :: Stats summed for every group, the averages are weighted by duration
+TOTALS = ('distance', 'duration', 'elevation_gain')
+
+
+def print_stats(file_paths: List[str], exercise_filter: ExerciseFilter = NO_FILTER):
+    """
+    Prints the distance, time, climbing and average heart rate of every generated exercise by
+    type and by month. Only the index is read, not the GPX files.
+
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param exercise_filter: only include these exercises
+    """
+    exercises = get_generated_metadata(file_paths, exercise_filter)
+    with_stats = [e for e in exercises if 'distance' in e]
+    if len(with_stats) < len(exercises):
+        print(f'{len(exercises) - len(with_stats)} exercises were generated by an older version without stats, '
+              f'run generate again to include them')
+    if not with_stats:
+        raise Exception('No generated exercises with stats, run generate first')
+    _print_table('Exercise type', _group(with_stats, lambda e: e['exercise_type']))
+    print()
+    _print_table('Month', _group(with_stats, lambda e: e['start_time'][:7]))
+
+
+def _group(exercises: List[Dict[str, Any]], key) -> Dict[str, Dict[str, float]]:
+    """
+    :param exercises: gpx_metadata with stats
+    :param key: function giving the group of an exercise
+    :return: dict of group -> totals, number of exercises and heart rate weighted by duration
+    """
+    groups = defaultdict(lambda: defaultdict(float))
+    for exercise in exercises:
+        group = groups[key(exercise)]
+        group['exercises'] += 1
+        for total in TOTALS:
+            group[total] += exercise[total]
+        if exercise['average_heart_rate'] is not None:
+            group['heart_rate_seconds'] += exercise['average_heart_rate'] * exercise['duration']
+            group['heart_rate_duration'] += exercise['duration']
+    return groups
+
+
+def _print_table(title: str, groups: Dict[str, Dict[str, float]]):
+    """
+    :param title: what the groups are
+    :param groups: output of _group
+    """
+    print(f'{title:<16}{"Exercises":>10}{"Distance (km)":>15}{"Hours":>9}{"Climbed (m)":>13}{"Avg HR":>8}')
+    for name in sorted(groups):
+        group = groups[name]
+        heart_rate = f'{group["heart_rate_seconds"] / group["heart_rate_duration"]:.0f}' \
+            if group['heart_rate_duration'] else '-'
+        print(f'{name:<16}{group["exercises"]:>10.0f}{group["distance"] / 1000:>15,.1f}'
+              f'{group["duration"] / 3600:>9.1f}{group["elevation_gain"]:>13,.0f}{heart_rate:>8}')
@@ -0,0 +1,159 @@
+import os
+import hashlib
+from collections import defaultdict
+from functools import lru_cache
+from zipfile import ZipFile, ZipInfo
+from typing import IO, Dict, List, Iterable, Optional, Tuple
+
+
+class ExportArchive:
+    """
+    Read-only view of a Samsung Health export zip. Member names have any
+    nested root folder stripped and always use '/' so they look like an
+    extracted export.
+    """
+
+    def __init__(self, file_path: str):
+        if not os.path.isfile(file_path):
+            raise Exception(f'{file_path} does not exist!')
+        self.file_path = file_path
+        self.zip = ZipFile(file_path)
+        self.prefix = _find_zip_prefix(self.zip)
+        self.members = {}  # type: Dict[str, ZipInfo]
+        for info in self.zip.infolist():
+            if info.filename[-1] not in '/\\':
+                name = info.filename
+                if name.startswith(self.prefix): name = name[len(self.prefix):]
+                name = name.replace('\\', '/')
+                self.members[name] = info
+        self._exercise_files = None  # type: Optional[Dict[str, List[Tuple[str, bool]]]]
+
+    def namelist(self) -> List[str]:
+        """
+        :return: names of every file in the export relative to its root
+        """
+        return list(self.members.keys())
+
+    def getinfo(self, name: str) -> ZipInfo:
+        """
+        :param name: name of a file relative to the export root
+        :return: the ZipInfo describing it
+        """
+        return self.members[name]
+
+    def open(self, name: str) -> IO[bytes]:
+        """
+        Opens a file in the export without extracting it
+
+        :param name: name of a file relative to the export root
+        :return: binary file handle
+        """
+        return self.zip.open(self.members[name])
+
+    def exercise_files(self) -> Dict[str, List[Tuple[str, bool]]]:
+        """
+        Index of the exercise JSON files, built in one pass over the zip directory the first time it's asked for
+
+        :return: dict of id -> list of (name relative to the export root, whether it's an internal data file)
+        """
+        if self._exercise_files is None:
+            self._exercise_files = _index_exercise_files(self.members)
+        return self._exercise_files
+
+    def fingerprint(self, names: Iterable[str]) -> str:
+        """
+        Cheap fingerprint of some files taken from the zip directory (CRC and size) without reading them
+
+        :param names: names of files relative to the export root
+        :return: hex digest that changes if any of the files change
+        """
+        digest = hashlib.sha1()
+        for name in sorted(names):
+            info = self.members[name]
+            digest.update(f'{name}:{info.CRC}:{info.file_size}\n'.encode())
+        return digest.hexdigest()
+
+    def directory(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: dict of every file's name relative to the export root -> (CRC, size), from the zip directory
+        """
+        return {name: (info.CRC, info.file_size) for name, info in self.members.items()}
+
+    def exported_at(self) -> Tuple[int, int, int, int, int, int]:
+        """
+        :return: modified time of the newest file in the export, from the zip directory
+        """
+        return max(info.date_time for info in self.members.values())
+
+    def close(self):
+        self.zip.close()
+
+
+# NOTE :: Every export get_archive has opened, so they can be closed and not just forgotten
+_opened = []  # type: List[ExportArchive]
+
+
+@lru_cache(maxsize=None)
+def get_archive(file_path: str) -> ExportArchive:
+    """
+    Opens the export once per process and reuses it afterwards
+
+    :param file_path: path to zip file
+    :return: the opened export
+    """
+    archive = ExportArchive(file_path)
+    _opened.append(archive)
+    return archive
+
+
+def close_archives():
+    """
+    Closes every export get_archive has opened, the next call opens them again (e.g. after a zip was replaced)
+    """
+    for archive in _opened:
+        archive.close()
+    _opened.clear()
+    get_archive.cache_clear()
+
+
+def _index_exercise_files(names: Iterable[str]) -> Dict[str, List[Tuple[str, bool]]]:
+    """
+    Groups the JSON files in the first jsons/*.exercise folder by exercise id
+
+    :param names: names of every file in the export relative to its root
+    :return: dict of id -> list of (name, whether it's an internal data file)
+    """
+    found_json = False
+    exercise_folder = None
+    files = defaultdict(list)
+    for name in names:
+        if not name.startswith('jsons/'): continue
+        found_json = True
+        parts = name.split('/')
+        if not parts[1].endswith('.exercise'): continue
+        # NOTE :: Only the first exercise folder is used, same as when the export was extracted
+        if exercise_folder is None: exercise_folder = parts[1]
+        if parts[1] != exercise_folder or not name.endswith('.json'): continue
+        file_id = parts[-1].split('.')[0]
+        files[file_id].append((name, 'internal' in name))
+    if not found_json:
+        raise Exception('Cannot find any json files in export')
+    if exercise_folder is None:
+        raise Exception('Could not find a folder with JSON exercise files')
+    return dict(files)
+
+
+def _find_zip_prefix(zip: ZipFile) -> str:
+    """
+    Sees if the zip has a nested directory
+
+    :param zip: the open zipfile
+    :return: prefix to remove
+    """
+    for path in zip.namelist():
+        split_char = '/' if '/' in path else '\\'
+        # NOTE :: Assuming jsons folder exists and should be in root
+        if f'jsons{split_char}' in path:
+            prefix = path.split(split_char)[0]
+            return '' if prefix == 'jsons' else f'{prefix}{split_char}'
+    raise Exception('ZipFile is of an unknown structure...')
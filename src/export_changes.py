@@ -0,0 +1,45 @@
+from typing import Iterable, List, Set, Tuple
+from src.metrics import timed
+from src.export_archive import get_archive
+from src.activity_index import get_export_members, save_export_members
+
+# NOTE :: Most removed exercise ids to print by name
+MAX_LISTED = 10
+
+
+@timed('export_changes')
+def report_export_changes(file_path: str) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Compares the zip directory (CRC and size of every file) against what it was the last time this
+    export was seen and says what's different, e.g. when a newer export was saved under the same name.
+    Nothing is read from the zip to do this.
+
+    :param file_path: path to zip
+    :return: (new, changed, removed) member names, all empty the first time an export is seen
+    """
+    members = get_archive(file_path).directory()
+    saved = get_export_members(file_path)
+    if saved == members: return [], [], []
+    save_export_members(file_path, members)
+    if not saved: return [], [], []
+    new = sorted(name for name in members if name not in saved)
+    changed = sorted(name for name in members if name in saved and saved[name] != members[name])
+    removed = sorted(name for name in saved if name not in members)
+    print(f'{file_path} has changed since last time: {len(new)} new, {len(changed)} changed '
+          f'and {len(removed)} removed files')
+    removed_ids = _exercise_ids(removed) - _exercise_ids(members)
+    if removed_ids:
+        listed = ', '.join(sorted(removed_ids)[:MAX_LISTED])
+        more = f' and {len(removed_ids) - MAX_LISTED} more' if len(removed_ids) > MAX_LISTED else ''
+        print(f'{len(removed_ids)} exercises are no longer in the export: {listed}{more}')
+        print('NOTE :: Files already generated for them are kept and can still be uploaded')
+    return new, changed, removed
+
+
+def _exercise_ids(names: Iterable[str]) -> Set[str]:
+    """
+    :param names: member names relative to the export root
+    :return: ids of the exercises the exercise JSON files among them belong to
+    """
+    return {name.split('/')[-1].split('.')[0] for name in names
+            if name.startswith('jsons/') and '.exercise/' in name and name.endswith('.json')}
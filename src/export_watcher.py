@@ -0,0 +1,76 @@
+import os
+import glob
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+from src.export_archive import close_archives
+from src.export_changes import report_export_changes
+from src.exercise_manifest import build_manifest
+from src.file_utils import prep_working_dir, find_exports
+
+
+def watch_exports(paths: Iterable[str], interval: float, on_exports: Callable[[List[str]], None],
+                  sleep: Callable[[float], None] = time.sleep):
+    """
+    Watches for export zips being added or replaced and hands every export that can be read to on_exports
+    each time one is (and once to start with if there are any). Only the size and modified time of each zip
+    are looked at between changes, nothing is opened until one has landed. A zip that can't be read is left
+    out until it changes again and if on_exports fails it's tried again after the next interval.
+
+    :param paths: paths to zip files or folders of them
+    :param interval: seconds between looks
+    :param on_exports: called with paths to zip files ordered by when they were exported (see find_exports)
+    :param sleep: function to wait with, can be swapped out in a test
+    """
+    paths = list(paths)
+    # NOTE :: Path -> (size, modified time) of the zips that made it through a sync, were opened or couldn't be read
+    synced = {}  # type: Dict[str, Tuple[int, int]]
+    opened = {}  # type: Dict[str, Tuple[int, int]]
+    unreadable = {}  # type: Dict[str, Tuple[int, int]]
+    # NOTE :: Zips there at the start are taken as is, new ones have to sit still for an interval (no half copied zips)
+    previous = _snapshot(paths)
+    while True:
+        current = _snapshot(paths)
+        landed = [path for path, stat in current.items() if stat not in (synced.get(path), unreadable.get(path))]
+        if landed and all(previous.get(path) == stat for path, stat in current.items()):
+            # NOTE :: A zip replaced under the same name has to be opened again
+            if any(opened.get(path, current[path]) != current[path] for path in landed): close_archives()
+            for path in sorted(landed):
+                if opened.get(path) == current[path]: continue
+                opened[path] = current[path]
+                try:
+                    prep_working_dir(path)
+                    report_export_changes(path)
+                    # NOTE :: Finding the exercise list here means a zip that isn't a Samsung export never joins a sync
+                    build_manifest(path)
+                except Exception as e:
+                    print(f'...could not read {path} ({e}), skipping it until it changes')
+                    unreadable[path] = current[path]
+            readable = [path for path in current if unreadable.get(path) != current[path]]
+            if any(path in readable for path in landed):
+                try:
+                    on_exports(find_exports(readable))
+                    synced = {path: current[path] for path in readable}
+                except Exception as e:
+                    print(f'...sync failed ({e}), trying again in {interval:g} seconds')
+            print(f'Waiting for new exports in {", ".join(paths)}...')
+            current = _snapshot(paths)
+        previous = current
+        sleep(interval)
+
+
+def _snapshot(paths: List[str]) -> Dict[str, Tuple[int, int]]:
+    """
+    :param paths: paths to zip files or folders of them
+    :return: dict of path to every zip there right now -> (size, modified time in nanoseconds)
+    """
+    zips = []
+    for path in paths:
+        zips.extend(glob.glob(os.path.join(path, '*.zip')) if os.path.isdir(path) else [path])
+    snapshot = {}
+    for path in zips:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
@@ -1,29 +1,64 @@
 import os
+import io
 import glob
-import json
+import gzip
 from pathlib import Path
-from zipfile import ZipFile
-from collections import defaultdict
-from typing import Dict, Set, Iterable
-from src.constants import STRAVANATOR_FOLDER, STRAVANATOR_UPLOADED
+from typing import IO, Dict, List, NamedTuple, Set, Iterable, Union
+from src.track import Track
+from src.gpx_writer import write_gpx
+from src.fit_writer import write_fit
+from src.metrics import timed, count
+from src.export_archive import get_archive
+from src.constants import STRAVANATOR_FOLDER, ACTIVITY_FILE_TYPES
+
+
+class InMemoryFile(NamedTuple):
+    """
+    A generated file that was never written to disk
+    """
+    name: str
+    content: bytes
 
 
 def prep_working_dir(file_path: str):
     """
-    Uncompress the zip file in the data folder. Will not do it if it already
-    exists. If the folder is nested, it'll flatten it.
+    Makes sure the zip file can be read and creates a folder in data for
+    the files we generate. The export itself is read in place, not extracted.
 
     :param file_path: path to zipped dir
     """
+    get_archive(file_path)
     data_path = get_data_path(file_path)
-    if not os.path.isfile(file_path):
-        raise Exception(f'{file_path} does not exist!')
-    if os.path.isdir(data_path):
-        print('Folder already exists. skipping zip file processing...')
-    else:
-        _extract_zip_dir(file_path, data_path)
+    if not os.path.isdir(data_path): os.makedirs(data_path)
+
+
+def find_exports(paths: Iterable[str]) -> List[str]:
+    """
+    Gets the export zips to work on, oldest first. Samsung exports are full snapshots so
+    when the same exercise is in several of them the last one in this list has the newest copy.
+
+    :param paths: paths to zip files or folders of them
+    :return: paths to zip files ordered by when they were exported
+    """
+    file_paths = set()
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.update(glob.glob(os.path.join(path, '*.zip')))
+        else:
+            file_paths.add(path)
+    if not file_paths:
+        raise Exception(f'No zip files found in {", ".join(paths)}')
+    return sorted(file_paths, key=lambda f: (get_archive(f).exported_at(), f))
+
 
-def get_data_path(file_path: str) -> str:
+def get_data_root() -> Path:
+    """
+    :return: path to the relative data folder
+    """
+    return Path(__file__).parent.parent / "data"
+
+
+def get_data_path(file_path: str) -> Path:
     """
     Creates a path for a dir of the right name in the relative data folder
 
@@ -33,48 +68,32 @@ def get_data_path(file_path: str) -> str:
     file_path = file_path.replace('.zip', '')
     split_char = '/' if '/' in file_path else '\\'
     file_name = file_path.split(split_char)[-1]
-    return Path(__file__).parent.parent / f"data/{file_name}"
+    return get_data_root() / file_name
 
 
+@timed('get_exercise_files')
 def get_exercise_files(file_path: str, exclude_internal: bool = False) -> Dict[str, Set[str]]:
     """
     Gets all exercise JSON files
 
     :param file_path: path to zip file
     :param exclude_internal: don't include internal data files
-    :return: dict of id -> set of file paths
+    :return: dict of id -> set of member names in the zip
     """
-    files = defaultdict(set)
-    data_path = get_data_path(file_path)
-    json_path = Path(data_path) / "jsons"
-    if not os.path.isdir(json_path):
-        raise Exception('Cannot find any json files in extract')
-    exercise_path = Path(json_path) / _get_exercise_path(json_path)
-    for json_file in glob.glob(str(Path(exercise_path) / '**/*.json')):
-        split_char = '/' if '/' in json_file else '\\'
-        file_name = json_file.split(split_char)[-1]
-        file_id = file_name.split('.')[0]
-        if not (exclude_internal and 'internal' in json_file):
-            files[file_id].add(json_file)
+    files = {}
+    for file_id, json_files in get_archive(file_path).exercise_files().items():
+        names = {name for name, internal in json_files if not (exclude_internal and internal)}
+        if names: files[file_id] = names
     return files
 
 
-def get_gpx_files(file_path: str) -> Dict[str, Set[str]]:
+def get_data_type(gpx_path: Union[str, InMemoryFile]) -> str:
     """
-    Gets all exercise GPX files
-
-    :param file_path: path to zip file
-    :return: dict of exercise type -> set of file paths
+    :param gpx_path: path to a generated activity file (or the file itself if it's only in memory)
+    :return: the data_type Strava expects for it (gpx, gpx.gz...)
     """
-    files = defaultdict(set)
-    data_path = get_data_path(file_path)
-    root_path = Path(data_path) / STRAVANATOR_FOLDER
-    for gpx_file in glob.glob(str(Path(root_path) / '**/*.gpx')):
-        exercise_folder = str(Path(gpx_file).parent)
-        split_char = '/' if '/' in exercise_folder else '\\'
-        exercise_type = exercise_folder.split(split_char)[-1]
-        files[exercise_type].add(gpx_file)
-    return files
+    if isinstance(gpx_path, InMemoryFile): gpx_path = gpx_path.name
+    return ACTIVITY_FILE_TYPES[_get_extension(gpx_path)]
 
 
 def setup_gpx_folders(file_path: str, exercises: Iterable[str]):
@@ -92,127 +111,82 @@ def setup_gpx_folders(file_path: str, exercises: Iterable[str]):
         if not os.path.isdir(e_path): os.mkdir(e_path)
 
 
-def save_gpx(file_path: str, gpx_metadata: Dict[str, str], gpx: str):
+@timed('save_gpx')
+def save_gpx(file_path: str, gpx_metadata: Dict[str, str], track: Track, extension: str = '.gpx'):
     """
-    Saves a GPX file for a particular exercise
+    Streams a GPX (or FIT) file for a particular exercise to disk
 
     :param file_path: path to zip
     :param gpx_metadata: metadata for this exercise and gpx file
-    :param gpx: gpx content
+    :param track: merged track with location on every row
+    :param extension: kind of file to write, one of ACTIVITY_FILE_TYPES (.gz files are gzipped, which Strava accepts)
     """
-    data_path = get_data_path(file_path)
-    exercise_type = gpx_metadata['exercise_type']
-    exercise_folder = Path(data_path) / STRAVANATOR_FOLDER / exercise_type
+    exercise_file = get_gpx_path(file_path, gpx_metadata['exercise_type'], gpx_metadata['exercise_id'], extension)
+    exercise_folder = exercise_file.parent
     f_id = gpx_metadata['exercise_id']
-    exercise_file = exercise_folder / f'{f_id}.gpx'
-    with open(exercise_file, 'w') as outfile:
-        outfile.write(gpx)
-    metadata_file = exercise_folder / f'{f_id}.json'
-    with open(metadata_file, 'w') as outfile:
-        outfile.write(json.dumps(gpx_metadata))
+    # NOTE :: Don't leave behind a copy in another format or it'd be uploaded twice
+    for other in ACTIVITY_FILE_TYPES:
+        if not str(exercise_file).endswith(other) and os.path.isfile(exercise_folder / f'{f_id}{other}'):
+            os.remove(exercise_folder / f'{f_id}{other}')
+    with open(exercise_file, 'wb') as raw:
+        _write_activity(raw, gpx_metadata, track, extension)
+    count('save_gpx', bytes_written=os.path.getsize(exercise_file), points=len(track.start_time))
 
 
-def get_gpx_metadata(gpx_path: str) -> Dict[str, str]:
+@timed('render_gpx')
+def render_gpx(gpx_metadata: Dict[str, str], track: Track, extension: str = '.gpx') -> InMemoryFile:
     """
-    Retrieves metadata for a gpx file
+    Same as save_gpx but keeps the file in memory instead of writing it to disk
 
-    :param gpx_path: path to a gpx file
-    :return: dict containing info like exercise_id, description, exercise_type
+    :param gpx_metadata: metadata for this exercise and gpx file
+    :param track: merged track with location on every row
+    :param extension: kind of file to make, one of ACTIVITY_FILE_TYPES
+    :return: the file
     """
-    gpx_path = str(Path(gpx_path))
-    metadata_path = gpx_path.replace('.gpx', '.json')
-    with open(metadata_path, 'r') as infile:
-        return json.load(infile)
+    raw = io.BytesIO()
+    _write_activity(raw, gpx_metadata, track, extension)
+    count('render_gpx', bytes_written=raw.tell(), points=len(track.start_time))
+    return InMemoryFile(f'{gpx_metadata["exercise_id"]}{extension}', raw.getvalue())
 
 
-def get_upload_files(file_path: str) -> Dict[str, Set[str]]:
+def _write_activity(raw: IO[bytes], gpx_metadata: Dict[str, str], track: Track, extension: str):
     """
-    Get the files that need to be uploaded that are new
-
-    :param file_path: path to zip
+    :param raw: binary file handle to write to, left open
+    :param gpx_metadata: metadata for this exercise and gpx file
+    :param track: merged track with location on every row
+    :param extension: kind of file to write, one of ACTIVITY_FILE_TYPES
     """
-    data_path = get_data_path(file_path)
-    uploaded_files = _get_uploaded_files(data_path)
-    gpx_files = get_gpx_files(file_path)
-    new_files = defaultdict(set)
-    for exercise_type, files in gpx_files.items():
-        for f in files:
-            f_id = get_gpx_metadata(f)['exercise_id']
-            if f_id not in uploaded_files:
-                new_files[exercise_type].add(f)
-    return new_files
+    # NOTE :: mtime=0 so the same track always produces the same bytes
+    outfile = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) if extension.endswith('.gz') else raw
+    if extension.startswith('.fit'):
+        write_fit(outfile, gpx_metadata, track)
+    else:
+        text = io.TextIOWrapper(outfile, encoding='utf-8')
+        write_gpx(text, gpx_metadata, track)
+        text.flush()
+        text.detach()
+    if outfile is not raw: outfile.close()
 
 
-def mark_uploaded(file_path: str, exercise_id: str):
+def get_gpx_path(file_path: str, exercise_type: str, exercise_id: str, extension: str = '.gpx') -> Path:
     """
-    Save a file as uploaded
-
     :param file_path: path to zip
-    :param exercise_id: id of uploaded file
+    :param exercise_type: the type of exercise
+    :param exercise_id: id of the exercise
+    :param extension: kind of file, one of ACTIVITY_FILE_TYPES
+    :return: where the GPX (or FIT) file for this exercise is saved
     """
     data_path = get_data_path(file_path)
-    exercise_folder = Path(data_path) / STRAVANATOR_FOLDER
-    uploaded_file = exercise_folder / STRAVANATOR_UPLOADED
-    with open(uploaded_file, 'a') as outfile:
-        outfile.write(exercise_id)
-        outfile.write('\n')
+    return Path(data_path) / STRAVANATOR_FOLDER / exercise_type / f'{exercise_id}{extension}'
 
 
-def _get_uploaded_files(data_path: str) -> Set[str]:
+def _get_extension(gpx_path: str) -> str:
     """
-    Gets a set of exercise ids that have been uploaded in the past
-    NOTE :: Uses a local file to figure this out
-
-    :param data_path: path to data dir
+    :param gpx_path: path to a generated activity file
+    :return: the longest known activity file extension it ends with
     """
-    exercise_folder = Path(data_path) / STRAVANATOR_FOLDER
-    uploaded_file = exercise_folder / STRAVANATOR_UPLOADED
-    if not os.path.isfile(uploaded_file):
-        with open(uploaded_file, 'w') as outfile:
-            pass
-    with open(uploaded_file, 'r') as infile:
-        return set([f.strip() for f in infile.readlines()])
-
+    for extension in sorted(ACTIVITY_FILE_TYPES, key=len, reverse=True):
+        if gpx_path.endswith(extension):
+            return extension
+    raise Exception(f'{gpx_path} is not a known activity file')
 
-def _extract_zip_dir(file_path: str, data_path: str):
-    """
-    Extracts directory from zipfile and saves it in data
-
-    :param file_path: path to the zip file
-    :param data_path: path of dir to extract it to
-    """
-    zip = ZipFile(file_path)
-    prefix = _find_zip_prefix(zip)
-    for info in zip.infolist():
-        if info.filename[-1] != '/':
-            info.filename = info.filename.replace(prefix, "")
-            zip.extract(info, data_path)
-    zip.close()
-
-
-def _find_zip_prefix(zip: ZipFile) -> str:
-    """
-    Sees if the zip has a nested directory
-
-    :param zip: the open zipfile
-    :return: prefix to remove
-    """
-    for path in zip.namelist():
-        split_char = '/' if '/' in path else '\\'
-        # NOTE :: Assuming jsons folder exists and should be in root
-        if f'jsons{split_char}' in path:
-            prefix = path.split(split_char)[0]
-            return '' if prefix == 'jsons' else f'{prefix}{split_char}'
-    raise Exception('ZipFile is of an unknown structure...')
-
-
-def _get_exercise_path(json_path: str) -> str:
-    """
-    Get path to folder with exercise jsons
-
-    :param json_path: path to json files folder
-    """
-    for path in os.listdir(json_path):
-        if path.endswith('.exercise'):
-            return path
-    raise Exception('Could not find a folder with JSON exercise files')
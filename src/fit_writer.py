@@ -0,0 +1,168 @@
+import struct
+import numpy as np
+from typing import IO, Dict, List, Tuple
+from src.track import Track
+from src.constants import FIT_SPORTS
+
+# NOTE :: FIT timestamps count seconds from 1989-12-31 00:00:00 UTC
+FIT_EPOCH = 631065600
+FIT_PROFILE_VERSION = 2132
+SEMICIRCLES_PER_DEGREE = 2 ** 31 / 180
+# NOTE :: Base types, with the value that means "no data" for the ones we leave blank
+ENUM, UINT8, UINT16, SINT32, UINT32, UINT32Z = 0x00, 0x02, 0x84, 0x85, 0x86, 0x8C
+INVALID_UINT8, INVALID_UINT16 = 0xFF, 0xFFFF
+# NOTE :: (local message type, global message number, [(field number, size, base type)])
+FILE_ID = (0, 0, [(0, 1, ENUM), (1, 2, UINT16), (2, 2, UINT16), (3, 4, UINT32Z), (4, 4, UINT32)])
+EVENT = (1, 21, [(253, 4, UINT32), (0, 1, ENUM), (1, 1, ENUM)])
+RECORD = (2, 20, [(253, 4, UINT32), (0, 4, SINT32), (1, 4, SINT32), (2, 2, UINT16), (3, 1, UINT8), (4, 1, UINT8)])
+LAP = (3, 19, [(253, 4, UINT32), (2, 4, UINT32), (7, 4, UINT32), (8, 4, UINT32), (0, 1, ENUM), (1, 1, ENUM)])
+SESSION = (4, 18, [(253, 4, UINT32), (2, 4, UINT32), (7, 4, UINT32), (8, 4, UINT32), (5, 1, ENUM), (0, 1, ENUM),
+                   (1, 1, ENUM)])
+ACTIVITY = (5, 34, [(253, 4, UINT32), (0, 4, UINT32), (1, 2, UINT16), (2, 1, ENUM), (3, 1, ENUM), (4, 1, ENUM)])
+# NOTE :: One record data message, packed the same way the RECORD definition says
+RECORD_DTYPE = np.dtype([('header', '<u1'), ('timestamp', '<u4'), ('latitude', '<i4'), ('longitude', '<i4'),
+                         ('altitude', '<u2'), ('heart_rate', '<u1'), ('cadence', '<u1')])
+# NOTE :: Event numbers and types from the FIT profile
+TIMER_EVENT, LAP_EVENT, SESSION_EVENT, ACTIVITY_EVENT = 0, 9, 8, 26
+START, STOP, STOP_ALL = 0, 1, 4
+DEVELOPMENT_MANUFACTURER = 255
+
+
+def write_fit(outfile: IO[bytes], gpx_metadata: Dict[str, str], track: Track):
+    """
+    Writes a FIT activity file: a file_id, one record per point and the lap, session and activity
+    summaries Strava expects at the end. Points are packed as one numpy array instead of one at a time.
+
+    :param outfile: binary file handle to write to
+    :param gpx_metadata: metadata for this exercise
+    :param track: merged track with location on every row
+    """
+    timestamps = np.round(track.start_time).astype(np.int64) - FIT_EPOCH
+    start, end = int(timestamps[0]), int(timestamps[-1])
+    elapsed_ms = (end - start) * 1000
+    sport = FIT_SPORTS.get(gpx_metadata['exercise_type'], 0)
+    body = b''.join([
+        _definition(*FILE_ID), _data(FILE_ID, 4, DEVELOPMENT_MANUFACTURER, 0, 0, start),
+        _definition(*EVENT), _data(EVENT, start, TIMER_EVENT, START),
+        _definition(*RECORD), _records(timestamps, track),
+        _data(EVENT, end, TIMER_EVENT, STOP_ALL),
+        _definition(*LAP), _data(LAP, end, start, elapsed_ms, elapsed_ms, LAP_EVENT, STOP),
+        _definition(*SESSION), _data(SESSION, end, start, elapsed_ms, elapsed_ms, sport, SESSION_EVENT, STOP),
+        _definition(*ACTIVITY), _data(ACTIVITY, end, elapsed_ms, 1, 0, ACTIVITY_EVENT, STOP),
+    ])
+    header = struct.pack('<BBHI4s', 14, 0x10, FIT_PROFILE_VERSION, len(body), b'.FIT')
+    header += struct.pack('<H', _crc(header))
+    outfile.write(header)
+    outfile.write(body)
+    # NOTE :: The file's CRC covers the header too
+    outfile.write(struct.pack('<H', _crc(body, _crc(header))))
+
+
+def _definition(local_type: int, global_number: int, fields: List[Tuple[int, int, int]]) -> bytes:
+    """
+    :return: definition message for a local message type (little endian)
+    """
+    definition = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields))
+    return definition + b''.join(struct.pack('<BBB', *field) for field in fields)
+
+
+def _data(message: Tuple[int, int, List[Tuple[int, int, int]]], *values: int) -> bytes:
+    """
+    :param message: the message's (local type, global number, fields)
+    :param values: a value for each field in order
+    :return: data message
+    """
+    local_type, _, fields = message
+    formats = {1: 'B', 2: 'H', 4: 'I'}
+    return struct.pack('<B' + ''.join(formats[size] for _, size, _ in fields), local_type, *values)
+
+
+def _records(timestamps: np.ndarray, track: Track) -> bytes:
+    """
+    :param timestamps: FIT timestamp of every row
+    :param track: merged track with location on every row
+    :return: a record data message for every row
+    """
+    records = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+    records['header'] = RECORD[0]
+    records['timestamp'] = timestamps
+    records['latitude'] = np.round(track.latitude * SEMICIRCLES_PER_DEGREE)
+    records['longitude'] = np.round(track.longitude * SEMICIRCLES_PER_DEGREE)
+    # NOTE :: Missing (or zero) values are left out of the GPX so they're marked invalid here
+    records['altitude'] = _scaled(track.altitude, 5, 500, INVALID_UINT16)
+    records['heart_rate'] = _scaled(track.heart_rate, 1, 0, INVALID_UINT8)
+    records['cadence'] = _scaled(track.cadence, 1, 0, INVALID_UINT8)
+    return records.tobytes()
+
+
+def _scaled(column: np.ndarray, scale: float, offset: float, invalid: int) -> np.ndarray:
+    """
+    :param column: a track column
+    :param scale: FIT scale of the field
+    :param offset: FIT offset of the field
+    :param invalid: the field's invalid value, which is also one more than the largest it can hold
+    :return: the column as FIT stores it with invalid where values are missing
+    """
+    missing = np.isnan(column) | (column == 0)
+    values = np.clip(np.round((np.nan_to_num(column) + offset) * scale), 0, invalid - 1)
+    return np.where(missing, invalid, values).astype(np.int64)
+
+
+def _crc_table() -> List[int]:
+    """
+    :return: lookup table for the FIT CRC (CRC-16 with the 0xA001 polynomial) a byte at a time
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+# NOTE :: The data is split into lanes this long which are all worked through side by side
+CRC_LANE = 256
+
+
+def _crc_shift_tables() -> Tuple[List[int], List[int]]:
+    """
+    The CRC is linear so running one through CRC_LANE zero bytes is the XOR of what that does to its two bytes
+
+    :return: lookup tables for the low and high byte of a CRC run through CRC_LANE zero bytes
+    """
+    table = np.array(CRC_TABLE, dtype=np.int64)
+    shifted = np.concatenate([np.arange(256), np.arange(256) << 8])
+    for _ in range(CRC_LANE):
+        shifted = (shifted >> 8) ^ table[shifted & 0xFF]
+    return shifted[:256].tolist(), shifted[256:].tolist()
+
+
+CRC_SHIFT_LOW, CRC_SHIFT_HIGH = _crc_shift_tables()
+
+
+def _crc(data: bytes, crc: int = 0) -> int:
+    """
+    Works out the CRC of every CRC_LANE bytes at once with numpy and then chains them together,
+    so Python only loops once per lane (and over the few bytes left at the end)
+
+    :param data: bytes to check
+    :param crc: CRC of whatever came before them
+    :return: the FIT CRC
+    """
+    lanes = len(data) // CRC_LANE
+    if lanes > 1:
+        block = np.frombuffer(data, dtype=np.uint8, count=lanes * CRC_LANE).reshape(lanes, CRC_LANE).T.astype(np.int64)
+        table = np.array(CRC_TABLE, dtype=np.int64)
+        crcs = np.zeros(lanes, dtype=np.int64)
+        crcs[0] = crc
+        for column in block:
+            crcs = (crcs >> 8) ^ table[(crcs ^ column) & 0xFF]
+        crc = 0
+        for lane_crc in crcs.tolist():
+            crc = CRC_SHIFT_LOW[crc & 0xFF] ^ CRC_SHIFT_HIGH[crc >> 8] ^ lane_crc
+        data = data[lanes * CRC_LANE:]
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
@@ -1,114 +1,293 @@
+import os
 import json
 import glob
 import datetime
 from pathlib import Path
-from collections import defaultdict
-from typing import Set, Optional, Any, List, Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import Set, Optional, List, Dict, Tuple, Iterator, Callable, Union
+from src import metrics
 from src.exercise_manifest import build_manifest
-from src.file_utils import get_exercise_files, setup_gpx_folders, save_gpx
+from src.exercise_filter import ExerciseFilter, NO_FILTER
+from src.export_archive import ExportArchive, get_archive
+from src.track import Track, from_samples, concat, select, merge_seconds, has_location, simplify, summarize
+from src.constants import STRAVANATOR_GENERATOR_VERSION, SIMPLIFY_MAX_GAP
+from src.activity_index import get_generation_state, record_generation, save_index, find_generated_copy
+from src.file_utils import get_exercise_files, setup_gpx_folders, save_gpx, render_gpx, get_gpx_path, get_data_root, \
+    InMemoryFile
 
 
-def generate_gpx_files(file_path: str):
+def generate_gpx_files(file_paths: List[str], workers: int = 1, extension: str = '.gpx',
+                       tolerance: Optional[float] = None, exercise_filter: ExerciseFilter = NO_FILTER,
+                       exclude: Set[str] = frozenset(),
+                       on_built: Optional[Callable[[Union[str, InMemoryFile], Dict[str, str]], None]] = None,
+                       save: bool = True, window: Optional[int] = None):
     """
-    Create a directory with subfolders for exercise types with GPX files
+    Create a directory with subfolders for exercise types with GPX files for each export.
+    Exports are done newest first and an exercise is only generated from the newest export it's in.
+
+    :param file_paths: paths to zip files, oldest export first (see find_exports)
+    :param workers: number of processes to build GPX files with
+    :param extension: kind of file to write, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only generate these exercises
+    :param exclude: ids of exercises not to build (e.g. ones that have already been uploaded)
+    :param on_built: called with (path or in memory file, gpx_metadata) as soon as each file is built,
+    oldest exercise in each export first
+    :param save: write the files to disk and record them in the index, otherwise they're only handed to on_built
+    :param window: most built files to have waiting for on_built at once (None for no limit)
+    """
+    newer = set()
+    for file_path in reversed(file_paths):
+        if len(file_paths) > 1: print(f'Generating {file_path}')
+        newer |= _generate_export(file_path, newer, workers, extension, tolerance, exercise_filter,
+                                  exclude, on_built, save, window)
+
+
+def _generate_export(file_path: str, newer: Set[str], workers: int = 1, extension: str = '.gpx',
+                     tolerance: Optional[float] = None, exercise_filter: ExerciseFilter = NO_FILTER,
+                     exclude: Set[str] = frozenset(),
+                     on_built: Optional[Callable[[Union[str, InMemoryFile], Dict[str, str]], None]] = None,
+                     save: bool = True, window: Optional[int] = None) -> Set[str]:
+    """
+    Generates the GPX files for one export. Exercises whose files haven't changed since the last run
+    (in this export or any other) are skipped.
 
     :param file_path: path to zip file
+    :param newer: ids of exercises in newer exports which are left to those exports
+    :param workers: number of processes to build GPX files with
+    :param extension: kind of file to write, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only generate these exercises, picked out of the manifest before any JSON is opened
+    :param exclude: ids of exercises not to build (e.g. ones that have already been uploaded)
+    :param on_built: called with (path or in memory file, gpx_metadata) as soon as each file is built,
+    oldest exercise in each export first
+    :param save: write the files to disk and record them in the index, otherwise they're only handed to on_built
+    :param window: most built files to have waiting for on_built at once (None for no limit)
+    :return: ids of every exercise generated from this export
     """
     # NOTE :: Not going to generate files for unknown exercise types
-    manifest = build_manifest(file_path, skip_unknown=True)
+    manifest = build_manifest(file_path, skip_unknown=True, exercise_filter=exercise_filter)
     all_exercise_files = get_exercise_files(file_path, exclude_internal=True)
     setup_gpx_folders(file_path, manifest.keys())
-    for exercise_type, exercise_ids in manifest.items():
-        for exercise_id in exercise_ids:
-            exercise_files = all_exercise_files.get(exercise_id)
-            gpx_metadata, gpx = _make_gpx(exercise_type, exercise_id, exercise_files)
-            if gpx:
-                save_gpx(file_path, gpx_metadata, gpx)
+    archive = get_archive(file_path)
+    cache = get_generation_state(file_path)
+    jobs, fingerprints = [], []
+    skipped, copied, excluded = 0, 0, 0
+    try:
+        # NOTE :: Sorted so every run (and every worker count) does the same work in the same order
+        for exercise_type in sorted(manifest):
+            for exercise_id in sorted(manifest[exercise_type]):
+                if exercise_id in newer:
+                    skipped += 1
+                    continue
+                if exercise_id in exclude:
+                    excluded += 1
+                    continue
+                exercise_files = all_exercise_files.get(exercise_id, set())
+                fingerprint = _fingerprint(archive, exercise_type, exercise_files, extension, tolerance)
+                if _is_cached(cache.get(exercise_id), fingerprint): continue
+                # NOTE :: An older export of the same exercise already has the file, point to it instead of rebuilding
+                copy = find_generated_copy(exercise_id, fingerprint)
+                if copy is not None:
+                    gpx_file, gpx_metadata = copy
+                    gpx_path = get_data_root() / gpx_file if gpx_file else None
+                    record_generation(file_path, exercise_type, exercise_id, fingerprint, gpx_metadata, gpx_path)
+                    # NOTE :: When syncing the uploader writes to the index from another thread, don't lock it out
+                    if on_built: save_index()
+                    copied += 1
+                    continue
+                jobs.append((file_path, exercise_type, exercise_id, exercise_files, extension, tolerance, save))
+                fingerprints.append(fingerprint)
+        if on_built:
+            # NOTE :: Hand files over in the order the exercises happened so each day's turn up together
+            order = sorted(range(len(jobs)), key=lambda i: (manifest[jobs[i][1]][jobs[i][2]], i))
+            jobs, fingerprints = [jobs[i] for i in order], [fingerprints[i] for i in order]
+        for job, fingerprint, (gpx_metadata, content) in zip(jobs, fingerprints, _run_jobs(jobs, workers, window)):
+            _, exercise_type, exercise_id, _, extension, _, _ = job
+            gpx_path = get_gpx_path(file_path, exercise_type, exercise_id, extension) if gpx_metadata else None
+            # NOTE :: Files that only exist in memory aren't recorded so they get built again next time
+            if content is None:
+                record_generation(file_path, exercise_type, exercise_id, fingerprint, gpx_metadata, gpx_path)
+                if on_built: save_index()
+            if gpx_metadata:
+                print(f'Finished building {gpx_metadata["exercise_name"]}')
+                if on_built: on_built(content or str(gpx_path), gpx_metadata)
+    finally:
+        save_index()
+    exercise_ids = set().union(*manifest.values())
+    unchanged = len(exercise_ids) - len(jobs) - skipped - excluded
+    print(f'{unchanged} exercises unchanged (cached), {len(jobs)} rebuilt')
+    if copied: print(f'{copied} of the unchanged exercises were already generated from another export')
+    if skipped: print(f'{skipped} exercises left to a newer export')
+    if excluded: print(f'{excluded} exercises already uploaded')
+    return exercise_ids
+
+
+def _fingerprint(archive: ExportArchive, exercise_type: str, files: Set[str], extension: str,
+                 tolerance: Optional[float] = None) -> str:
+    """
+    :param archive: the opened export
+    :param exercise_type: the type of exercise
+    :param files: json files for this exercise
+    :param extension: kind of file being written
+    :param tolerance: how much tracks are simplified (None if they aren't)
+    :return: key that changes if the files or the way we generate from them changes
+    """
+    fingerprint = f'{STRAVANATOR_GENERATOR_VERSION}:{exercise_type}:{extension}:{archive.fingerprint(files)}'
+    return fingerprint if tolerance is None else f'{fingerprint}:{tolerance}'
+
+
+def _is_cached(entry: Optional[Tuple[Optional[str], Optional[str]]], fingerprint: str) -> bool:
+    """
+    Whether the last run already generated this exercise from the same files
+
+    :param entry: (fingerprint, gpx file) the index has for this exercise
+    :param fingerprint: fingerprint of the exercise right now
+    :return: True if it can be skipped
+    """
+    if not entry or entry[0] != fingerprint: return False
+    return entry[1] is None or os.path.isfile(get_data_root() / entry[1])
+
+
+def _run_jobs(jobs: List[Tuple[str, str, str, Set[str], str, Optional[float], bool]], workers: int,
+              window: Optional[int] = None) -> Iterator[Tuple[Optional[Dict[str, str]], Optional[InMemoryFile]]]:
+    """
+    Builds the file for every job, in a process pool if there's more than one worker
+
+    :param jobs: list of (file_path, exercise_type, exercise_id, files, extension, tolerance, save)
+    :param workers: number of processes to use
+    :param window: most jobs to have running or finished but not yet handed back at once (None for no limit)
+    :return: (gpx_metadata or None, the file if it wasn't saved) for each job in the same order as jobs
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield _build_exercise(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        if window is None:
+            # NOTE :: Small chunks keep the pool busy when a few exercises are much longer than the rest
+            chunksize = max(1, len(jobs) // (workers * 8))
+            results = pool.map(_build_exercise_in_worker, jobs, chunksize=chunksize)
+        else:
+            results = _windowed(pool, jobs, max(window, workers))
+        for built, collected in results:
+            metrics.merge(collected)
+            yield built
 
 
-def _make_gpx(exercise_type: str, exercise_id: str, files: Set[str]) -> Optional[Tuple[Dict[str, str], str]]:
+def _windowed(pool: ProcessPoolExecutor, jobs: List[Tuple], window: int) -> Iterator[Tuple]:
     """
-    Make a merged GPX file if location data is available.
+    Like pool.map but only submits a job once there's room for its result, so built files that
+    haven't been picked up don't pile up in memory
+
+    :param pool: the process pool
+    :param jobs: jobs for _build_exercise_in_worker
+    :param window: most jobs submitted and not yet handed back
+    :return: results in the same order as jobs
+    """
+    futures = deque()
+    for job in jobs:
+        if len(futures) >= window: yield futures.popleft().result()
+        futures.append(pool.submit(_build_exercise_in_worker, job))
+    while futures:
+        yield futures.popleft().result()
+
+
+def _init_worker():
+    """
+    Drops any zip handle inherited from the parent process since it shares the parent's file offset
+    and any metrics it had collected so they're not counted twice
+    """
+    get_archive.cache_clear()
+    metrics.drain()
+
+
+def _build_exercise_in_worker(job: Tuple[str, str, str, Set[str], str, Optional[float], bool]
+                              ) -> Tuple[Tuple[Optional[Dict[str, str]], Optional[InMemoryFile]], Dict]:
+    """
+    Same as _build_exercise but also hands back the metrics collected in the worker
+
+    :param job: (file_path, exercise_type, exercise_id, files, extension, tolerance, save)
+    :return: (output of _build_exercise, metrics to merge into the parent's)
+    """
+    built = _build_exercise(job)
+    return built, metrics.drain()
+
+
+def _build_exercise(job: Tuple[str, str, str, Set[str], str, Optional[float], bool]
+                    ) -> Tuple[Optional[Dict[str, str]], Optional[InMemoryFile]]:
+    """
+    Makes and saves the GPX file for one exercise. Runs inside the worker processes.
+
+    :param job: (file_path, exercise_type, exercise_id, files, extension, tolerance, save)
+    :return: (gpx_metadata if a GPX file was built, the file itself if it wasn't saved to disk)
+    """
+    file_path, exercise_type, exercise_id, exercise_files, extension, tolerance, save = job
+    archive = get_archive(file_path)
+    gpx_metadata, track = _make_gpx(archive, exercise_type, exercise_id, exercise_files, tolerance)
+    if gpx_metadata is None: return None, None
+    if not save: return gpx_metadata, render_gpx(gpx_metadata, track, extension)
+    save_gpx(file_path, gpx_metadata, track, extension)
+    return gpx_metadata, None
+
+
+@metrics.timed('_make_gpx')
+def _make_gpx(archive: ExportArchive, exercise_type: str, exercise_id: str, files: Set[str],
+              tolerance: Optional[float] = None) -> Optional[Tuple[Dict[str, str], Track]]:
+    """
+    Merge the exercise files into the track for a GPX file if location data is available.
     Naming convention is f'{date} {exercise_type} (Strava-nator)'
 
+    :param archive: the opened export
     :param exercise_type: the type of exercise
     :param exercise_id: id of the exercise
     :param files: list of files to open and get exercise info
-    :return: (gpx_metadata, gpx content) if location data is present
-    """
-    merged_data = _merge_data(files)
-    if not merged_data: return None, None
-    date_string = datetime.datetime.utcfromtimestamp(merged_data[0]['start_time']).isoformat()
-    exercise_name = f"{datetime.datetime.utcfromtimestamp(merged_data[0]['start_time']).date().isoformat()} {exercise_type.capitalize()} (Strava-nator)"
-    header = (
-        f'<?xml version="1.0" encoding="UTF-8"?>'
-        f'<gpx creator="StravaGPX" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v1 http://www.garmin.com/xmlschemas/TrackPointExtensionv1.xsd" version="1.1" xmlns="http://www.topografix.com/GPX/1/1" xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3">'
-        f'<metadata>'
-        f'<time>{date_string}</time>'
-        f'</metadata>'
-        f'<trk>'
-        f'<name>{exercise_name}</name>'
-        f'<type>1</type>'
-        f'<trkseg>'
-    )
-    body = []
-    for d in merged_data:
-        latitude = d.get('latitude')
-        longitude = d.get('longitude')
-        altitude = d.get('altitude')
-        heart_rate = d.get('heart_rate')
-        cadence = d.get('cadence')
-        start_time = datetime.datetime.utcfromtimestamp(d['start_time']).isoformat()
-        if latitude and longitude:
-            body.append(f'<trkpt lat="{latitude}" lon="{longitude}">')
-            body.append(f'<time>{start_time}</time>')
-            if altitude: body.append(f'<ele>{altitude}</ele>')
-            if cadence:
-                cadence_gpx = (
-                    f'<extensions>'
-                    f'<cadence>{cadence}</cadence>'
-                    f'</extensions>'
-                )
-                body.append(cadence_gpx)
-            if heart_rate:
-                hr_gpx = (
-                    f'<extensions>'
-                    f'<gpxtpx:TrackPointExtension>'
-                    f'<gpxtpx:hr>{heart_rate}</gpxtpx:hr>'
-                    f'</gpxtpx:TrackPointExtension>'
-                    f'</extensions>'
-                )
-                body.append(hr_gpx)
-            body.append('</trkpt>')
-    closing = (
-        f'</trkseg>'
-        f'</trk>'
-        f'</gpx>'
-    )
-    if len(body) == 0: return None, None
-    body = "\n".join(body)
-    print(f'Finished building {exercise_name}')
+    :param tolerance: simplify the track to within this many meters (None keeps every point)
+    :return: (gpx_metadata, track of the points with a location) if location data is present
+    """
+    merged_data = _merge_data(archive, files)
+    if merged_data is None: return None, None
+    first_time = merged_data.start_time[0].item()
+    last_time = merged_data.start_time[-1].item()
+    date_string = datetime.datetime.utcfromtimestamp(first_time).isoformat()
+    exercise_name = f"{datetime.datetime.utcfromtimestamp(first_time).date().isoformat()} {exercise_type.capitalize()} (Strava-nator)"
+    located = select(merged_data, has_location(merged_data))
+    if len(located.start_time) == 0: return None, None
     gpx_metadata = {'exercise_name': exercise_name, 'exercise_id': exercise_id,
-                    'exercise_type': exercise_type, 'start_time': date_string}
-    return gpx_metadata, f'{header}{body}{closing}'
+                    'exercise_type': exercise_type, 'start_time': date_string,
+                    'end_time': datetime.datetime.utcfromtimestamp(last_time).isoformat()}
+    with metrics.stage('summarize'):
+        gpx_metadata.update(summarize(merged_data))
+    if tolerance is not None:
+        with metrics.stage('simplify'):
+            simplified = simplify(located, tolerance, SIMPLIFY_MAX_GAP)
+        metrics.count('simplify', points=len(located.start_time))
+        located = simplified
+    metrics.count('_make_gpx', points=len(located.start_time))
+    return gpx_metadata, located
 
 
-def _merge_data(files: Set[str]) -> Optional[List[Dict[str, Any]]]:
+@metrics.timed('_merge_data')
+def _merge_data(archive: ExportArchive, files: Set[str]) -> Optional[Track]:
     """
     Merges info from all of the files together
 
+    :param archive: the opened export
     :param files: json files for this exercise
+    :return: one row per second sorted by start_time if there's location data
     """
     found_location_data = False
-    merged_data = defaultdict(dict)
-    for f in files:
-        with open(f, 'r') as infile:
+    tracks = []
+    # NOTE :: Later files win when samples collide so the order has to be stable
+    for f in sorted(files):
+        metrics.count('_merge_data', bytes_read=archive.getinfo(f).file_size)
+        with archive.open(f) as infile:
             data = json.load(infile)
             if not isinstance(data, List): continue
-            for d in data:
-                if 'latitude' in d or 'longitude' in d: found_location_data = True
-                if 'start_time' in d:
-                    d['start_time'] = d['start_time'] / 1000
-                    index_time = round(d['start_time'])
-                    merged_data[index_time].update(d)
-    return None if not found_location_data else list(sorted(merged_data.values(), key=lambda d: d['start_time']))
+            if not found_location_data:
+                found_location_data = any('latitude' in d or 'longitude' in d for d in data)
+            tracks.append(from_samples([d for d in data if 'start_time' in d]))
+            metrics.count('_merge_data', points=len(tracks[-1].start_time))
+    return None if not found_location_data else merge_seconds(concat(tracks))
+
@@ -0,0 +1,64 @@
+import datetime
+import numpy as np
+from typing import IO, Dict, List, Optional
+from src.track import Track
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<gpx creator="StravaGPX" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/TrackPointExtension/v1 http://www.garmin.com/xmlschemas/TrackPointExtensionv1.xsd" version="1.1" xmlns="http://www.topografix.com/GPX/1/1" xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" xmlns:gpxx="http://www.garmin.com/xmlschemas/GpxExtensions/v3">'
+)
+GPX_CLOSING = '</trkseg></trk></gpx>'
+# NOTE :: Number of <trkpt> elements built up before each write to the file
+CHUNK_SIZE = 1000
+
+
+def write_gpx(outfile: IO[str], gpx_metadata: Dict[str, str], track: Track):
+    """
+    Streams a GPX document to an open file a chunk of points at a time
+
+    :param outfile: text file handle to write to
+    :param gpx_metadata: metadata for this exercise
+    :param track: merged track with location on every row
+    """
+    outfile.write(GPX_HEADER)
+    outfile.write(
+        f'<metadata>'
+        f'<time>{gpx_metadata["start_time"]}</time>'
+        f'</metadata>'
+        f'<trk>'
+        f'<name>{gpx_metadata["exercise_name"]}</name>'
+        f'<type>1</type>'
+        f'<trkseg>\n'
+    )
+    for start in range(0, len(track.start_time), CHUNK_SIZE):
+        rows = slice(start, start + CHUNK_SIZE)
+        columns = (track.start_time[rows].tolist(), track.latitude[rows].tolist(), track.longitude[rows].tolist(),
+                   _optional(track.altitude[rows]), _optional(track.heart_rate[rows]), _optional(track.cadence[rows]))
+        outfile.write(''.join(_trkpt(*row) for row in zip(*columns)))
+    outfile.write(GPX_CLOSING)
+
+
+def _trkpt(timestamp: float, latitude: float, longitude: float, altitude: Optional[float],
+           heart_rate: Optional[float], cadence: Optional[float]) -> str:
+    """
+    :return: one <trkpt> element with a single <extensions> block for HR and cadence
+    """
+    start_time = datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+    point = f'<trkpt lat="{latitude}" lon="{longitude}"><time>{start_time}</time>'
+    if altitude: point += f'<ele>{altitude}</ele>'
+    if heart_rate or cadence:
+        point += '<extensions><gpxtpx:TrackPointExtension>'
+        if heart_rate: point += f'<gpxtpx:hr>{heart_rate}</gpxtpx:hr>'
+        if cadence: point += f'<gpxtpx:cad>{cadence}</gpxtpx:cad>'
+        point += '</gpxtpx:TrackPointExtension></extensions>'
+    return point + '</trkpt>\n'
+
+
+def _optional(column: np.ndarray) -> List[Optional[float]]:
+    """
+    :param column: a track column
+    :return: the values as floats with None where they're missing (or zero)
+    """
+    values = column.astype(object)
+    values[np.isnan(column) | (column == 0)] = None
+    return values.tolist()
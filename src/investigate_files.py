@@ -1,35 +1,159 @@
 import json
+import zipfile
+import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, IO, Iterator, List, Optional, Set, Tuple
+from src.export_archive import get_archive
+from src.exercise_manifest import build_manifest
 from src.file_utils import get_exercise_files
 
+# NOTE :: How much of a file is read at a time while looking for location data
+READ_SIZE = 64 * 1024
+LOCATION_KEYS = (b'"latitude"', b'"longitude"')
+# NOTE :: Exercises the CSV doesn't list with location data aren't in the manifest
+NOT_IN_MANIFEST = 'not in manifest'
 
-def investigate(file_path: str):
+
+def investigate(file_path: str, workers: int = 1):
     """
     Checks data for validity and how much will be imported
 
     :param file_path: path to zip
+    :param workers: number of processes to scan files with
     """
-    _check_lat_long(file_path)
+    results = _check_lat_long(file_path, workers)
+    _print_report(file_path, results)
 
 
-def _check_lat_long(file_path: str):
+def _check_lat_long(file_path: str, workers: int = 1) -> Dict[str, Dict[str, Any]]:
     """
-    Checks to see if any files contains lat/long
+    Checks to see which exercises have lat/long
 
     :param file_path: path to zip
+    :param workers: number of processes to scan files with
+    :return: dict of exercise id -> scan results (see _scan_exercise)
     """
-    count = 0
-    for json_files in get_exercise_files(file_path).values():
-        for json_file in json_files:
-            try:
-                with open(json_file, 'r') as infile:
-                    data = json.load(infile)
-                    for d in data:
-                        if 'latitude' in d or 'longitude' in d:
-                            count += 1
-                            break
-            except:
-                print(f'Failed to parse {json_file}')
+    exercise_files = get_exercise_files(file_path)
+    jobs = [(file_path, exercise_id, exercise_files[exercise_id]) for exercise_id in sorted(exercise_files)]
+    results = dict(zip((job[1] for job in jobs), _run_scans(jobs, workers)))
+    for result in results.values():
+        for json_file, error in result['errors']:
+            print(f'Failed to parse {json_file}: {error}')
+    count = sum(1 for result in results.values() if result['points'])
     if not count:
         raise Exception('No files have lat/long info')
     else:
-        print(f'Found {count} files with location data!')
+        print(f'Found {count} exercises with location data!')
+    return results
+
+
+def _run_scans(jobs: List[Tuple[str, str, Set[str]]], workers: int) -> Iterator[Dict[str, Any]]:
+    """
+    Scans every job, in a process pool if there's more than one worker
+
+    :param jobs: list of (file_path, exercise_id, files)
+    :param workers: number of processes to use
+    :return: scan results in the same order as jobs
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield _scan_exercise(job)
+        return
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield from pool.map(_scan_exercise, jobs, chunksize=chunksize)
+
+
+def _init_worker():
+    """
+    Drops any zip handle inherited from the parent process since it shares the parent's file offset
+    """
+    get_archive.cache_clear()
+
+
+def _scan_exercise(job: Tuple[str, str, Set[str]]) -> Dict[str, Any]:
+    """
+    Looks through an exercise's files for location samples. Location files go first and once
+    one of them has GPS the rest (the long heart rate and cadence series) are skipped.
+
+    :param job: (file_path, exercise_id, files)
+    :return: dict of points (samples with a location), start and end (seconds) and errors
+    """
+    file_path, _, files = job
+    archive = get_archive(file_path)
+    result = {'points': 0, 'start': None, 'end': None, 'errors': []}
+    for json_file in sorted(files, key=lambda f: ('location_data' not in f, f)):
+        try:
+            with archive.open(json_file) as infile:
+                data = _read_if_located(infile)
+        except (ValueError, zipfile.BadZipFile, OSError) as e:
+            result['errors'].append((json_file, str(e)))
+            continue
+        if not isinstance(data, list): continue
+        located = [d for d in data if isinstance(d, dict) and ('latitude' in d or 'longitude' in d)]
+        times = [d['start_time'] for d in located if isinstance(d.get('start_time'), (int, float))]
+        result['points'] += len(located)
+        if times: result['start'], result['end'] = min(times) / 1000, max(times) / 1000
+        if result['points']: break
+    return result
+
+
+def _read_if_located(infile: IO[bytes]) -> Optional[Any]:
+    """
+    Reads a file a chunk at a time until a location key shows up and only then parses it.
+    Files without one (most of them) are never parsed at all.
+
+    :param infile: binary file handle
+    :return: the parsed JSON or None if the file has no location keys
+    """
+    chunks = []
+    tail = b''
+    while True:
+        chunk = infile.read(READ_SIZE)
+        if not chunk: return None
+        chunks.append(chunk)
+        # NOTE :: Keep the end of the last chunk around in case a key is split between two chunks
+        window = tail + chunk
+        if any(key in window for key in LOCATION_KEYS): break
+        tail = chunk[-16:]
+    chunks.append(infile.read())
+    return json.loads(b''.join(chunks))
+
+
+def _print_report(file_path: str, results: Dict[str, Dict[str, Any]]):
+    """
+    Prints how many exercises of each type have GPS, how many points and how long they cover
+
+    :param file_path: path to zip
+    :param results: dict of exercise id -> scan results
+    """
+    exercise_types = {}
+    for exercise_type, exercise_ids in build_manifest(file_path).items():
+        for exercise_id in exercise_ids:
+            exercise_types[exercise_id] = exercise_type
+    report = defaultdict(lambda: {'exercises': 0, 'gps': 0, 'points': 0, 'seconds': 0.0, 'first': None, 'last': None})
+    for exercise_id, result in results.items():
+        row = report[exercise_types.get(exercise_id, NOT_IN_MANIFEST)]
+        row['exercises'] += 1
+        if not result['points']: continue
+        row['gps'] += 1
+        row['points'] += result['points']
+        if result['start'] is not None:
+            row['seconds'] += result['end'] - result['start']
+            row['first'] = result['start'] if row['first'] is None else min(row['first'], result['start'])
+            row['last'] = result['start'] if row['last'] is None else max(row['last'], result['start'])
+    print(f'{"Exercise type":<22}{"Exercises":>10}{"With GPS":>10}{"GPS points":>12}{"GPS hours":>11}  Dates')
+    for exercise_type in sorted(report, key=lambda t: (-report[t]['gps'], t)):
+        row = report[exercise_type]
+        dates = f'{_date(row["first"])} to {_date(row["last"])}' if row['first'] is not None else '-'
+        print(f'{exercise_type:<22}{row["exercises"]:>10}{row["gps"]:>10}{row["points"]:>12,}'
+              f'{row["seconds"] / 3600:>11.1f}  {dates}')
+
+
+def _date(timestamp: Optional[float]) -> str:
+    """
+    :param timestamp: seconds since the epoch
+    :return: the UTC date
+    """
+    return datetime.datetime.utcfromtimestamp(timestamp).date().isoformat()
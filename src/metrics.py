@@ -0,0 +1,106 @@
+import json
+import time
+import functools
+from contextlib import contextmanager
+from collections import defaultdict, Counter
+from typing import Callable, Dict, Iterator
+
+# NOTE :: Every stage gets these even if nothing was counted for it
+FIELDS = ('calls', 'seconds', 'bytes_read', 'bytes_written', 'points', 'api_calls', 'sleep_seconds')
+
+# NOTE :: Stage name -> Counter of FIELDS. Collected all the time (it's cheap), only shown when asked for
+_stages = defaultdict(Counter)  # type: Dict[str, Counter]
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times a block of code as one call of a stage. Stages can be nested, an outer stage's
+    time includes the stages inside it.
+
+    :param name: name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages[name]['calls'] += 1
+        _stages[name]['seconds'] += time.perf_counter() - start
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator version of stage() for a whole function
+
+    :param name: name of the stage
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, **amounts: float):
+    """
+    Adds to the counters of a stage, e.g. count('save_gpx', bytes_written=1024, points=300)
+
+    :param name: name of the stage
+    :param amounts: field -> amount to add
+    """
+    _stages[name].update(amounts)
+
+
+def drain() -> Dict[str, Dict[str, float]]:
+    """
+    Takes everything collected so far in this process and starts over. Worker processes
+    send this back so the parent can merge() it.
+
+    :return: stage -> field -> value
+    """
+    collected = {name: dict(counters) for name, counters in _stages.items()}
+    _stages.clear()
+    return collected
+
+
+def merge(collected: Dict[str, Dict[str, float]]):
+    """
+    Adds what another process collected into this one
+
+    :param collected: output of drain() in the other process
+    """
+    for name, counters in collected.items():
+        _stages[name].update(counters)
+
+
+def get_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    :return: stage -> field -> value with every field filled in
+    """
+    return {name: {field: round(counters[field], 4) for field in FIELDS} for name, counters in _stages.items()}
+
+
+def print_metrics():
+    """
+    Prints a table of every stage
+    """
+    print(f'{"Stage":<20}{"Calls":>8}{"Seconds":>10}{"MB read":>10}{"MB written":>12}{"Points":>12}'
+          f'{"API calls":>11}{"Slept (s)":>11}')
+    for name, row in get_metrics().items():
+        print(f'{name:<20}{row["calls"]:>8.0f}{row["seconds"]:>10.2f}{row["bytes_read"] / 2 ** 20:>10.1f}'
+              f'{row["bytes_written"] / 2 ** 20:>12.1f}{row["points"]:>12,.0f}{row["api_calls"]:>11.0f}'
+              f'{row["sleep_seconds"]:>11.1f}')
+    print('NOTE :: _make_gpx includes _merge_data and stages run in worker processes add up their time')
+
+
+def save_metrics(path: str, **extra):
+    """
+    Writes every stage to a JSON file
+
+    :param path: where to write it
+    :param extra: anything else to include at the top level (method, total time...)
+    """
+    with open(path, 'w') as outfile:
+        outfile.write(json.dumps({**extra, 'stages': get_metrics()}, indent=2))
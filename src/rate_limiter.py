@@ -0,0 +1,96 @@
+import time
+from typing import Callable, Mapping, Optional
+from src.constants import STRAVA_RATE_LIMIT, STRAVA_DAILY_RATE_LIMIT, STRAVA_RATE_INTERVAL
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+class RateLimiter:
+    """
+    Keeps track of Strava's 15 minute and daily request windows. Both reset on the clock
+    (00, 15, 30, 45 past the hour and midnight UTC) and the usage Strava reports in the
+    X-RateLimit-Usage / X-RateLimit-Limit headers of every response wins over our own count.
+
+    The clock and sleep functions can be swapped out to simulate a long upload in a test.
+    """
+
+    def __init__(self, short_limit: int = STRAVA_RATE_LIMIT, daily_limit: int = STRAVA_DAILY_RATE_LIMIT,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.clock = clock
+        self.sleep = sleep
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.requests = 0
+        self.slept = 0.0
+        self.last_status = None  # type: Optional[int]
+        self._windows = self._current_windows()
+
+    def acquire(self):
+        """
+        Blocks until a request fits in both windows and then counts it against them.
+        last_status is cleared so it only ever describes a response to this request.
+        """
+        self.last_status = None
+        while True:
+            self._roll_windows()
+            wait_until = None
+            if self.daily_usage >= self.daily_limit:
+                wait_until = (self._windows[1] + 1) * DAY_SECONDS
+            elif self.short_usage >= self.short_limit:
+                wait_until = (self._windows[0] + 1) * self._short_seconds()
+            if wait_until is None: break
+            wait = max(0.0, wait_until - self.clock()) + 1
+            print(f'Ran out of requests. Waiting {wait / 60:.1f} minutes for the next rate limit window...')
+            self.sleep(wait)
+            self.slept += wait
+        self.short_usage += 1
+        self.daily_usage += 1
+        self.requests += 1
+
+    def update_from_headers(self, headers: Mapping[str, str], status_code: int = 200):
+        """
+        Resyncs with what Strava says we've used. A 429 means the short window is spent
+        whatever the headers say.
+
+        :param headers: headers of a Strava API response
+        :param status_code: status code of the response
+        """
+        self._roll_windows()
+        self.last_status = status_code
+        limit = headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-RateLimit-Usage')
+        if limit and usage:
+            self.short_limit, self.daily_limit = [int(v) for v in limit.split(',')[:2]]
+            self.short_usage, self.daily_usage = [int(v) for v in usage.split(',')[:2]]
+        if status_code == 429:
+            self.short_usage = max(self.short_usage, self.short_limit)
+
+    def hook(self, response, *args, **kwargs):
+        """
+        requests response hook so every call made through a session updates the limiter
+
+        :param response: the requests response
+        """
+        self.update_from_headers(response.headers, response.status_code)
+
+    def _roll_windows(self):
+        """
+        Clears the usage of any window that has reset since we last looked
+        """
+        windows = self._current_windows()
+        if windows[0] != self._windows[0]: self.short_usage = 0
+        if windows[1] != self._windows[1]: self.daily_usage = 0
+        self._windows = windows
+
+    def _current_windows(self):
+        """
+        :return: (index of the current 15 minute window, index of the current day) since the epoch
+        """
+        now = self.clock()
+        return int(now // self._short_seconds()), int(now // DAY_SECONDS)
+
+    @staticmethod
+    def _short_seconds() -> int:
+        return STRAVA_RATE_INTERVAL * 60
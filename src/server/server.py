@@ -1,11 +1,11 @@
 #!flask/bin/python
 import os
 import logging
-from pathlib import Path
 
 from flask import Flask, render_template, redirect, url_for, request, jsonify
+from threading import Event
 from stravalib import Client
-from dotenv import load_dotenv
+from src.strava_tokens import load_env, save_tokens
 
 app = Flask(__name__)
 
@@ -40,14 +40,15 @@ def logged_in():
         access_token = client.exchange_code_for_token(client_id=os.environ['STRAVA_CLIENT_ID'],
                                                       client_secret=os.environ['STRAVA_CLIENT_SECRET'],
                                                       code=code)
-        # Probably here you'd want to store this somewhere -- e.g. in a database.
+        save_tokens(access_token)
         strava_athlete = client.get_athlete()
+        app.config['authorized'].set()
 
         return render_template('login_results.html', athlete=strava_athlete, access_token=access_token)
 
 
-def start(client: Client):
-    env_path = Path(__file__).parent.parent.parent / ".env"
-    load_dotenv(dotenv_path=env_path)
+def start(client: Client, authorized: Event):
+    load_env()
     app.config['global_client'] = client
+    app.config['authorized'] = authorized
     app.run()
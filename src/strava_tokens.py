@@ -0,0 +1,63 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Tuple
+from src.file_utils import get_data_root
+from src.constants import STRAVA_TOKEN_FILE, STRAVA_TOKEN_REFRESH_MARGIN
+
+
+def get_token_path() -> Path:
+    """
+    :return: where the Strava tokens are kept
+    """
+    return get_data_root() / STRAVA_TOKEN_FILE
+
+
+def load_env():
+    """
+    Loads STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET from the .env file in the repo root
+    """
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=Path(__file__).parent.parent / '.env')
+
+
+def get_client_credentials() -> Tuple[int, str]:
+    """
+    :return: (client id, client secret) of the Strava app
+    """
+    if 'STRAVA_CLIENT_ID' not in os.environ or 'STRAVA_CLIENT_SECRET' not in os.environ:
+        raise Exception('Add STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET to your .env file')
+    return int(os.environ['STRAVA_CLIENT_ID']), os.environ['STRAVA_CLIENT_SECRET']
+
+
+def load_tokens() -> Optional[Dict[str, Any]]:
+    """
+    :return: dict of access_token, refresh_token and expires_at (epoch seconds) or None if we've never authorized
+    """
+    if not os.path.isfile(get_token_path()): return None
+    with open(get_token_path(), 'r') as infile:
+        return json.load(infile)
+
+
+def save_tokens(access_info: Mapping[str, Any]):
+    """
+    Saves the tokens from an authorization or refresh, readable only by the current user
+
+    :param access_info: dict with access_token, refresh_token and expires_at
+    """
+    tokens = {k: access_info[k] for k in ('access_token', 'refresh_token', 'expires_at')}
+    os.makedirs(get_data_root(), exist_ok=True)
+    descriptor = os.open(get_token_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(descriptor, 'w') as outfile:
+        outfile.write(json.dumps(tokens))
+    # NOTE :: os.open only applies the mode when it creates the file
+    os.chmod(get_token_path(), 0o600)
+
+
+def needs_refresh(tokens: Mapping[str, Any]) -> bool:
+    """
+    :param tokens: saved tokens
+    :return: True if the access token has expired or is about to
+    """
+    return tokens['expires_at'] - STRAVA_TOKEN_REFRESH_MARGIN < time.time()
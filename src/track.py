@@ -0,0 +1,155 @@
+import numpy as np
+from typing import NamedTuple, List, Dict, Any, Optional
+
+TRACK_COLUMNS = ('start_time', 'latitude', 'longitude', 'altitude', 'heart_rate', 'cadence')
+EARTH_RADIUS = 6371000
+# NOTE :: Samples of altitude averaged together before adding up the climbs so GPS noise doesn't count
+ELEVATION_SMOOTHING = 5
+
+
+class Track(NamedTuple):
+    """
+    Columns of samples for one exercise. Times are in seconds and missing values are NaN.
+    """
+    start_time: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    altitude: np.ndarray
+    heart_rate: np.ndarray
+    cadence: np.ndarray
+
+
+def from_samples(samples: List[Dict[str, Any]]) -> Track:
+    """
+    Pulls the track columns out of a list of Samsung JSON samples
+
+    :param samples: samples that all have a start_time (in ms)
+    :return: unmerged track
+    """
+    columns = {c: np.array([d.get(c) for d in samples], dtype=np.float64) for c in TRACK_COLUMNS}
+    columns['start_time'] /= 1000
+    return Track(**columns)
+
+
+def concat(tracks: List[Track]) -> Track:
+    """
+    :param tracks: tracks to join end to end
+    :return: one track with all of the samples
+    """
+    if not tracks: return Track(*(np.empty(0) for _ in TRACK_COLUMNS))
+    return Track(*(np.concatenate(c) for c in zip(*tracks)))
+
+
+def select(track: Track, rows: np.ndarray) -> Track:
+    """
+    :param track: the track to pick from
+    :param rows: boolean mask or indices of the rows to keep
+    :return: track with only those rows
+    """
+    return Track(*(c[rows] for c in track))
+
+
+def merge_seconds(track: Track) -> Track:
+    """
+    Collapses samples into one row per rounded second. When samples share a second
+    the later one wins for every column it has a value for, like dict.update would.
+
+    :param track: samples in the order they were read
+    :return: merged track sorted by start_time
+    """
+    buckets = np.round(track.start_time)
+    order = np.argsort(buckets, kind='stable')
+    track = select(track, order)
+    unique, bucket_ids = np.unique(buckets[order], return_inverse=True)
+    merged = {}
+    for name, column in zip(TRACK_COLUMNS, track):
+        rows = np.flatnonzero(~np.isnan(column))
+        ids = bucket_ids[rows]
+        last = np.append(ids[1:] != ids[:-1], True) if len(ids) else ids.astype(bool)
+        merged[name] = np.full(len(unique), np.nan)
+        merged[name][ids[last]] = column[rows[last]]
+    return select(Track(**merged), np.argsort(merged['start_time'], kind='stable'))
+
+
+def has_location(track: Track) -> np.ndarray:
+    """
+    :param track: the track to check
+    :return: mask of the rows with a (non-zero) latitude and longitude
+    """
+    return (np.nan_to_num(track.latitude) != 0) & (np.nan_to_num(track.longitude) != 0)
+
+
+def summarize(track: Track) -> Dict[str, Optional[float]]:
+    """
+    Works out the stats Strava shows for an activity in one pass of array operations
+
+    :param track: merged track (rows without a location are used for the time and heart rate)
+    :return: dict of distance (meters), duration (seconds), elevation_gain (meters), average_heart_rate
+    and max_heart_rate (None when there's no heart rate)
+    """
+    located = select(track, has_location(track))
+    latitude, longitude = np.radians(located.latitude), np.radians(located.longitude)
+    # NOTE :: Haversine between every pair of neighbouring points at once
+    a = np.sin(np.diff(latitude) / 2) ** 2 + \
+        np.cos(latitude[:-1]) * np.cos(latitude[1:]) * np.sin(np.diff(longitude) / 2) ** 2
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1))).sum()
+    altitude = located.altitude[~np.isnan(located.altitude) & (located.altitude != 0)]
+    if len(altitude) >= ELEVATION_SMOOTHING:
+        altitude = np.convolve(altitude, np.ones(ELEVATION_SMOOTHING) / ELEVATION_SMOOTHING, mode='valid')
+    elevation_gain = np.clip(np.diff(altitude), 0, None).sum()
+    heart_rate = track.heart_rate[~np.isnan(track.heart_rate) & (track.heart_rate > 0)]
+    return {'distance': round(float(distance), 1),
+            'duration': round(float(track.start_time[-1] - track.start_time[0]), 1),
+            'elevation_gain': round(float(elevation_gain), 1),
+            'average_heart_rate': round(float(heart_rate.mean()), 1) if len(heart_rate) else None,
+            'max_heart_rate': float(heart_rate.max()) if len(heart_rate) else None}
+
+
+def simplify(track: Track, tolerance: float, max_gap: float) -> Track:
+    """
+    Drops the points a Douglas-Peucker pass says aren't needed to draw the route within tolerance.
+    Repeated points while stopped go too, as they're all on the line. A point is still kept at least
+    every max_gap seconds so elapsed and moving time and the heart rate and cadence stats barely change.
+
+    :param track: merged track with location on every row
+    :param tolerance: how far (in meters) the simplified route can be from the original
+    :param max_gap: most seconds between kept points
+    :return: track with only the rows that were kept
+    """
+    if len(track.start_time) < 3: return track
+    # NOTE :: Flat projection around the start is plenty accurate over the length of one exercise
+    latitude = np.radians(track.latitude)
+    x = np.radians(track.longitude) * np.cos(latitude[0]) * EARTH_RADIUS
+    y = latitude * EARTH_RADIUS
+    keep = _douglas_peucker(x, y, tolerance)
+    buckets = np.floor((track.start_time - track.start_time[0]) / max_gap)
+    keep[np.flatnonzero(np.diff(buckets)) + 1] = True
+    return select(track, keep)
+
+
+def _douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker without recursion, each span's distances are worked out in one go
+
+    :param x: meters east of some origin
+    :param y: meters north of the same origin
+    :param tolerance: points further than this from the segment they'd be dropped from are kept
+    :return: mask of the points to keep
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    spans = [(0, len(x) - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2: continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        # NOTE :: Distance to the segment, not the line, so the far end of an out and back isn't dropped
+        length = dx * dx + dy * dy
+        along = np.clip((px * dx + py * dy) / length, 0, 1) if length else 0
+        distances = np.hypot(px - along * dx, py - along * dy)
+        furthest = int(np.argmax(distances))
+        if distances[furthest] <= tolerance: continue
+        keep[first + 1 + furthest] = True
+        spans.extend([(first, first + 1 + furthest), (first + 1 + furthest, last)])
+    return keep
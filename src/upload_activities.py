@@ -1,172 +1,628 @@
+import io
+import re
 import sys
-import time
+import bisect
 import datetime
-from threading import Thread
+import itertools
+import requests
+from queue import Queue, Full
+from threading import Thread, Event
 from stravalib import Client
-from collections import defaultdict
-from typing import Dict, Set, List, Tuple
-from src.server.server import start
-from src.constants import STRAVA_RATE_LIMIT, STRAVA_RATE_INTERVAL
-from src.file_utils import get_upload_files, mark_uploaded, get_gpx_metadata
+from stravalib.client import ActivityUploader
+from collections import defaultdict, Counter, deque
+from typing import Any, Dict, List, Tuple, Optional, Callable, Iterable, Iterator, Union
+from src import metrics
+from src.rate_limiter import RateLimiter
+from src.exercise_filter import ExerciseFilter, NO_FILTER
+from src.generate_gpx import generate_gpx_files
+from src.export_watcher import watch_exports
+from src.constants import STRAVA_UPLOADS_IN_FLIGHT, STRAVA_POLL_INTERVAL, STRAVA_ACTIVITIES_PER_PAGE, \
+    STRAVA_MATCH_WINDOW, SYNC_QUEUE_DEPTH, WATCH_INTERVAL
+from src.file_utils import get_data_type, InMemoryFile
+from src.activity_index import get_upload_files, journal_upload, get_upload_journal, get_strava_activities, \
+    get_latest_strava_activity, save_strava_activities, get_uploaded_ids
+from src.strava_tokens import load_env, load_tokens, save_tokens, needs_refresh, get_client_credentials, \
+    get_token_path
 
+DUPLICATE_ERROR = re.compile(r'duplicate of (?:activity )?(\d+)')
 
-def upload_new_gpx(file_path: str):
+
+def upload_new_gpx(file_paths: List[str], in_flight: int = STRAVA_UPLOADS_IN_FLIGHT, yes: bool = False,
+                   exercise_filter: ExerciseFilter = NO_FILTER):
     """
     Uploads any new GPX files that haven't been seen before
 
-    :param file_path: the path to zip
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param in_flight: max number of uploads to have processing at once
+    :param yes: don't ask for confirmation (for running from cron), needs saved tokens
+    :param exercise_filter: only upload these exercises
+    """
+    client, limiter = _connect(yes)
+    try:
+        _double_check_user(client, yes)
+        _refresh_strava_activities(client, limiter)
+        new_files = _skip_synced(get_upload_files(file_paths, exercise_filter), get_strava_activities())
+        _double_check_file_counts(new_files, yes)
+        _upload_files(_sort_rename_files(new_files), client, limiter, in_flight, resume=get_upload_journal())
+    finally:
+        _save_client_tokens(client)
+
+
+def sync_new_exercises(file_paths: List[str], workers: int = 1, extension: str = '.gpx',
+                       tolerance: Optional[float] = None, exercise_filter: ExerciseFilter = NO_FILTER,
+                       in_flight: int = STRAVA_UPLOADS_IN_FLIGHT, yes: bool = False, save: bool = True):
+    """
+    Generates and uploads in one go. Files are built in another thread and handed to the uploader
+    through a bounded queue as soon as they're ready, so the first upload doesn't wait for the last
+    file to be built and only a few built files are held at once. Exercises that have already been
+    uploaded aren't built at all.
+
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param workers: number of processes to build files with
+    :param extension: kind of file to build, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only sync these exercises
+    :param in_flight: max number of uploads to have processing at once
+    :param yes: don't ask for confirmation (for running from cron), needs saved tokens
+    :param save: also write the files to disk like generate does, otherwise they're uploaded straight from memory
+    """
+    client, limiter = _connect(yes)
+    try:
+        _double_check_user(client, yes)
+        _sync_round(client, limiter, file_paths, workers, extension, tolerance, exercise_filter, in_flight, save,
+                    Counter())
+    finally:
+        _save_client_tokens(client)
+
+
+def watch_new_exports(paths: List[str], interval: float = WATCH_INTERVAL, workers: int = 1, extension: str = '.gpx',
+                      tolerance: Optional[float] = None, exercise_filter: ExerciseFilter = NO_FILTER,
+                      in_flight: int = STRAVA_UPLOADS_IN_FLIGHT, yes: bool = False, save: bool = True):
+    """
+    Runs until it's stopped, syncing every time an export zip is added or replaced. The Strava client,
+    its rate limit windows and the index stay open between syncs and everything already generated or
+    uploaded is skipped, so each sync only costs as much as the exercises that are new.
+
+    :param paths: paths to zip files or folders of them to watch
+    :param interval: seconds between looks for new zips
+    :param workers: number of processes to build files with
+    :param extension: kind of file to build, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only sync these exercises
+    :param in_flight: max number of uploads to have processing at once
+    :param yes: don't ask for confirmation (for running as a service), needs saved tokens
+    :param save: also write the files to disk like generate does, otherwise they're uploaded straight from memory
+    """
+    client, limiter = _connect(yes)
+    # NOTE :: Kept between syncs so an exercise on the same day as one from an earlier sync still gets a number
+    names = Counter()
+
+    def sync(file_paths: List[str]):
+        try:
+            _sync_round(client, limiter, file_paths, workers, extension, tolerance, exercise_filter, in_flight, save,
+                        names)
+        finally:
+            _save_client_tokens(client)
+
+    try:
+        _double_check_user(client, yes)
+        print(f'Watching {", ".join(paths)} for new exports every {interval:g} seconds, hit ctrl-c to stop')
+        watch_exports(paths, interval, sync)
+    finally:
+        _save_client_tokens(client)
+
+
+def _connect(yes: bool) -> Tuple[Client, RateLimiter]:
+    """
+    :param yes: running without prompts so there's nobody to do the OAuth flow
+    :return: (authorized client, the rate limiter its responses feed)
+    """
+    load_env()
+    limiter = RateLimiter()
+    client = _make_client(limiter)
+    _authorize(client, yes)
+    return client, limiter
+
+
+def _sync_round(client: Client, limiter: RateLimiter, file_paths: List[str], workers: int, extension: str,
+                tolerance: Optional[float], exercise_filter: ExerciseFilter, in_flight: int, save: bool,
+                names: Counter):
+    """
+    Builds the new exercises in these exports in another thread and uploads them as they come
+
+    :param client: client instance that should now be authorized
+    :param limiter: rate limiter fed by the client's responses
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param workers: number of processes to build files with
+    :param extension: kind of file to build, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only sync these exercises
+    :param in_flight: max number of uploads to have processing at once
+    :param save: also write the files to disk
+    :param names: how many exercises with each name have been uploaded so far (see _rename_duplicates)
+    """
+    _refresh_strava_activities(client, limiter)
+    built = Queue(maxsize=SYNC_QUEUE_DEPTH)
+    stop = Event()
+    producer = Thread(target=_produce_files,
+                      args=(built, stop, file_paths, workers, extension, tolerance, exercise_filter, save))
+    producer.daemon = True
+    producer.start()
+    try:
+        new_files = _stream_new_files(built, get_strava_activities(), names)
+        _upload_files(new_files, client, limiter, in_flight, resume=get_upload_journal())
+    finally:
+        # NOTE :: If the uploads stopped early the producer is told to give up instead of waiting on a full queue
+        stop.set()
+        producer.join()
+
+
+def _save_client_tokens(client: Client):
+    """
+    stravalib refreshes the token by itself on a long run so save whatever it ended up with
+
+    :param client: the client
+    """
+    if client.access_token:
+        save_tokens({'access_token': client.access_token, 'refresh_token': client.refresh_token,
+                     'expires_at': client.token_expires})
+
+
+def _produce_files(built: Queue, stop: Event, file_paths: List[str], workers: int, extension: str,
+                   tolerance: Optional[float], exercise_filter: ExerciseFilter, save: bool):
+    """
+    Runs in its own thread. Queues every file as it's built, then any files earlier runs built that were
+    never uploaded. Always finishes by queueing None (or the exception that stopped it) unless it's stopped.
+
+    :param built: queue of (path or in memory file, gpx_metadata) to fill, blocks while it's full
+    :param stop: set when nothing is taking files off the queue any more
+    :param file_paths: paths to zips, oldest export first (see find_exports)
+    :param workers: number of processes to build files with
+    :param extension: kind of file to build, one of ACTIVITY_FILE_TYPES
+    :param tolerance: simplify tracks to within this many meters (None keeps every point)
+    :param exercise_filter: only build these exercises
+    :param save: also write the files to disk
+    """
+    queued = set()
+
+    def on_built(path: Union[str, InMemoryFile], data: Dict[str, str]):
+        queued.add(data['exercise_id'])
+        if not _hand_over(built, stop, (path, data)): raise Exception('Uploads stopped, not building any more files')
+
+    try:
+        # NOTE :: The pool only builds a queue's worth ahead of the uploader so unclaimed files don't pile up
+        generate_gpx_files(file_paths, workers, extension, tolerance, exercise_filter, exclude=get_uploaded_ids(),
+                           on_built=on_built, save=save, window=SYNC_QUEUE_DEPTH)
+        for path, data in get_upload_files(file_paths, exercise_filter):
+            if data['exercise_id'] in queued: continue
+            if not _hand_over(built, stop, (path, data)): return
+        _hand_over(built, stop, None)
+    except BaseException as e:
+        _hand_over(built, stop, e)
+
+
+def _hand_over(built: Queue, stop: Event, item: Any) -> bool:
+    """
+    Waits for room on the queue, checking every second whether anyone is still taking things off it
+
+    :param built: queue filled by _produce_files
+    :param stop: set when nothing is taking files off the queue any more
+    :param item: what to put on the queue
+    :return: False if it was stopped before there was room
+    """
+    while not stop.is_set():
+        try:
+            built.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _stream_new_files(built: Queue, activities: List[Tuple[float, float, str, int]], names: Counter
+                      ) -> Iterator[Tuple[Union[str, InMemoryFile], Dict[str, str]]]:
+    """
+    Takes files off the queue as the uploader asks for them and drops the ones already on Strava.
+    Files come oldest first so each day's are held until the next day turns up and then numbered
+    like upload does (see _rename_duplicates).
+
+    :param built: queue filled by _produce_files
+    :param activities: list of (start time, elapsed time, type, activity id) sorted by start time
+    :param names: how many exercises with each name have been uploaded so far, updated as they're handed out
+    :return: (path or in memory file, gpx_metadata) for each file to upload
+    """
+    day = []  # type: List[Tuple[Union[str, InMemoryFile], Dict[str, str]]]
+    while True:
+        item = built.get()
+        if item is None: break
+        if isinstance(item, BaseException): raise item
+        for path, data in _skip_synced([item], activities):
+            if day and day[-1][1]['start_time'][:10] != data['start_time'][:10]:
+                yield from sorted(_rename_duplicates(day, names), key=lambda f: f[1]['start_time'])
+                day = []
+            day.append((path, data))
+    yield from sorted(_rename_duplicates(day, names), key=lambda f: f[1]['start_time'])
+
+
+def _make_client(limiter: RateLimiter) -> Client:
+    """
+    Makes a client whose every response goes through our rate limiter (instead of stravalib's)
+
+    :param limiter: the rate limiter to feed
+    :return: unauthorized client
+    """
+    session = requests.Session()
+    session.hooks['response'].append(limiter.hook)
+    return Client(rate_limit_requests=False, requests_session=session)
+
+
+def _authorize(client: Client, yes: bool):
     """
-    c = Client()
-    _start_oauth_server(c)
-    time.sleep(5)
-    _wait_for_oauth()
-    _double_check_user(c)
-    new_files = get_upload_files(file_path)
-    _double_check_file_counts(new_files)
-    _upload_files(_sort_rename_files(new_files), c, file_path)
+    Authorizes the client with the saved tokens (refreshing them if they're about to expire)
+    or sends the user through the OAuth flow in the browser if there aren't any
 
+    :param client: the client instance that will be authorized to make calls
+    :param yes: running without prompts so there's nobody to do the OAuth flow
+    """
+    tokens = load_tokens()
+    if tokens is None:
+        if yes: raise Exception('No saved Strava tokens, run upload once without --yes to authorize')
+        authorized = _start_oauth_server(client)
+        _wait_for_oauth(authorized)
+        return
+    client.access_token = tokens['access_token']
+    client.refresh_token = tokens['refresh_token']
+    client.token_expires = tokens['expires_at']
+    if needs_refresh(tokens):
+        print('Refreshing your Strava access token...')
+        client_id, client_secret = get_client_credentials()
+        save_tokens(client.refresh_access_token(client_id, client_secret, tokens['refresh_token']))
 
-def _start_oauth_server(client: Client):
+
+def _start_oauth_server(client: Client) -> Event:
     """
     Need to start a local Flask server in order to get creds to make API calls
 
     :param client: the client instance that will be authorized to make calls
+    :return: event that's set once the client has been authorized
     """
-    t = Thread(target=start, args=(client,))
+    # NOTE :: Flask is only imported when we actually need a new authorization
+    from src.server.server import start
+    authorized = Event()
+    t = Thread(target=start, args=(client, authorized))
     t.daemon = True
     t.start()
+    return authorized
 
 
-def _wait_for_oauth():
+def _wait_for_oauth(authorized: Event):
     """
-    Raw Input to wait for the user to complete the auth flow
+    Waits for the user to complete the auth flow in the browser
+
+    :param authorized: event that's set once the client has been authorized
     """
-    print('Please go to {http://localhost:5000} that is printed and follow in the browser')
-    input('Input your access token and hit Enter: ')
+    print('Please go to http://localhost:5000 and follow the steps in the browser')
+    authorized.wait()
 
 
-def _double_check_user(client: Client):
+def _double_check_user(client: Client, yes: bool = False):
     """
     Make sure this is the right user
 
     :param client: client that should now be authorized
+    :param yes: don't wait for confirmation
     """
     try:
         user = client.get_athlete()
     except:
         print('hmmm it seems we are not authorized to access your Strava...')
+        print(f'If you revoked access delete {get_token_path()} and try again')
         sys.exit(1)
     print(f'Are you {user.firstname} {user.lastname}?')
-    input('Hit ctrl-c if this is wrong otherwise hit enter...')
+    if not yes: input('Hit ctrl-c if this is wrong otherwise hit enter...')
 
 
-def _double_check_file_counts(new_files: Dict[str, Set[str]]):
+def _double_check_file_counts(new_files: List[Tuple[str, Dict[str, str]]], yes: bool = False):
     """
     Makes sure the right number of files are being uploaded
 
-    :param new_files: new GPX files that have been found
+    :param new_files: list of (path, gpx_metadata) for new GPX files that have been found
+    :param yes: don't wait for confirmation
     """
-    for exercise, files in new_files.items():
-        print(f'Found {len(files)} GPX files for activity:{exercise}')
+    for exercise, count in Counter(metadata['exercise_type'] for _, metadata in new_files).items():
+        print(f'Found {count} GPX files for activity:{exercise}')
     if len(new_files) == 0:
         print('No new files to upload for you...')
         sys.exit(0)
-    input('Hit ctrl-c if this is wrong otherwise hit enter...')
+    if not yes: input('Hit ctrl-c if this is wrong otherwise hit enter...')
+
+
+def _refresh_strava_activities(client: Client, limiter: RateLimiter):
+    """
+    Adds the athlete's activities that started after the newest one we have cached to the cache
+    (all of them the first time), a page at a time
+
+    :param client: client instance that should now be authorized
+    :param limiter: rate limiter fed by the client's responses
+    """
+    # NOTE :: Always send after so Strava lists oldest first, pages are saved as they come and a cut off run resumes
+    latest = get_latest_strava_activity() or 0
+    page, found = 1, 0
+    while True:
+        params = {'page': page, 'per_page': STRAVA_ACTIVITIES_PER_PAGE, 'after': int(latest)}
+        limiter.acquire()
+        try:
+            activities = client.protocol.get('/athlete/activities', **params)
+        except Exception:
+            if limiter.last_status == 429: continue
+            print('...could not list your Strava activities, Strava will have to catch any duplicates')
+            return
+        save_strava_activities([(a['id'], _epoch(a['start_date']), a.get('elapsed_time') or 0,
+                                 a.get('sport_type') or a.get('type'), a.get('external_id')) for a in activities])
+        found += len(activities)
+        if len(activities) < STRAVA_ACTIVITIES_PER_PAGE: break
+        page += 1
+    print(f'Found {found} new activities on Strava since last time')
 
 
-def _sort_rename_files(new_files: Dict[str, Set[str]]) -> List[Tuple[str, Dict[str, str]]]:
+def _skip_synced(new_files: List[Tuple[str, Dict[str, str]]], activities: List[Tuple[float, float, str, int]],
+                 journal: Callable[[str, Optional[int], str], None] = journal_upload) -> List[Tuple[str, Dict[str, str]]]:
     """
-    Takes the dict of exercise -> files and will flatten and sort them
+    Drops the files whose exercise overlaps in time with an activity already on Strava
+    (e.g. one Samsung's own sync got there first) and marks them as uploaded
+
+    :param new_files: list of (path, gpx_metadata) for new files
+    :param activities: list of (start time, elapsed time, type, activity id) sorted by start time
+    :param journal: called with (exercise id, None, 'uploaded') for every file that's skipped
+    :return: the files that still need uploading
+    """
+    starts = [a[0] for a in activities]
+    # NOTE :: Latest end of any activity up to each one so the search can stop as soon as nothing reaches back far enough
+    latest_ends = list(itertools.accumulate((a[0] + a[1] for a in activities), max))
+    remaining = []
+    for path, data in new_files:
+        start, end = _exercise_span(data)
+        match = None
+        i = bisect.bisect_left(starts, end) - 1
+        while i >= 0 and latest_ends[i] > start:
+            if starts[i] + activities[i][1] > start:
+                match = activities[i]
+                break
+            i -= 1
+        if match is None:
+            remaining.append((path, data))
+            continue
+        print(f'{data["exercise_name"]} is already on Strava ({match[2]} activity {match[3]}), skipping it')
+        journal(data['exercise_id'], None, 'uploaded')
+    return remaining
+
+
+def _exercise_span(data: Dict[str, str]) -> Tuple[float, float]:
+    """
+    :param data: gpx_metadata for a file
+    :return: (start, end) of the exercise in epoch seconds, a window around the start if the end isn't known
+    """
+    start = _epoch(data['start_time'])
+    if not data.get('end_time'): return start - STRAVA_MATCH_WINDOW, start + STRAVA_MATCH_WINDOW
+    return start, max(_epoch(data['end_time']), start + 1)
+
+
+def _epoch(timestamp: str) -> float:
+    """
+    :param timestamp: ISO 8601 time in UTC, with or without a trailing Z
+    :return: seconds since the epoch
+    """
+    parsed = datetime.datetime.fromisoformat(timestamp.replace('Z', ''))
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _sort_rename_files(new_files: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Takes the list of new files and will sort them
     It will also append number if there's an identical exercise in a day
 
-    :param new_files: dict of new files
+    :param new_files: list of (path, gpx_metadata) for new files
     :return: sorted array of (path, gpx_metadata)
     """
-    files = set()
-    for file_set in new_files.values():
-        files.update(file_set)
+    return list(sorted(_rename_duplicates(new_files, Counter()), key=lambda f: f[1]['start_time']))
+
+
+def _rename_duplicates(new_files: List[Tuple[Union[str, InMemoryFile], Dict[str, str]]], names: Counter
+                       ) -> List[Tuple[Union[str, InMemoryFile], Dict[str, str]]]:
+    """
+    Numbers exercises with the same name (the same type on the same day) #1, #2... by start time.
+    One on its own keeps its name unless one with that name was already handed out.
+
+    :param new_files: list of (path, gpx_metadata) for new files
+    :param names: how many exercises with each name were handed out before these, updated with these
+    :return: the files grouped by name
+    """
     file_name_mapping = defaultdict(list)
-    for f in files:
-        metadata = get_gpx_metadata(f)
+    for f, metadata in new_files:
         file_name_mapping[metadata['exercise_name']].append((f, metadata))
     files = []
-    for gpx_files in file_name_mapping.values():
-        if len(gpx_files) > 1:
+    for name, gpx_files in file_name_mapping.items():
+        if len(gpx_files) > 1 or names[name]:
             gpx_files = sorted(gpx_files, key=lambda g: g[1]['start_time'])
-            count = 1
+            count = names[name] + 1
             for path, metadata in gpx_files:
                 metadata['exercise_name'] = metadata['exercise_name'].replace('(Strava-nator)', f'#{count} (Strava-nator)')
                 count += 1
+        names[name] += len(gpx_files)
         files.extend(gpx_files)
-    return list(sorted(files, key=lambda f: f[1]['start_time']))
+    return files
 
 
-def _upload_files(new_files: List[Tuple[str, Dict[str, str]]],
-                  client: Client, file_path: str):
+@metrics.timed('_upload_files')
+def _upload_files(new_files: Iterable[Tuple[Union[str, InMemoryFile], Dict[str, str]]], client: Client,
+                  limiter: RateLimiter,
+                  in_flight: int = STRAVA_UPLOADS_IN_FLIGHT,
+                  journal: Callable[[str, Optional[int], str], None] = journal_upload,
+                  resume: Optional[Dict[str, int]] = None):
     """
-    Upload these files to the Strava API
+    Upload these files to the Strava API. Keeps several uploads processing on Strava's
+    side at once and polls all of them together instead of waiting on each one in turn.
 
-    :param new_files: list of tuples of (path, gpx_metadata)
+    :param new_files: iterable of tuples of (path or in memory file, gpx_metadata), read as there's room
     :param client: client instance that should now be authorized
-    :param file_path: path to zip
+    :param limiter: rate limiter fed by the client's responses
+    :param in_flight: max number of uploads to have processing at once
+    :param journal: called with (exercise id, upload id, status) when an upload is submitted and when it finishes
+    :param resume: dict of exercise id -> upload id for uploads an earlier run submitted but never saw finish
     """
-    requests_left = STRAVA_RATE_LIMIT
-    interval_start_time = time.time()
-    for path, data in new_files:
-        if requests_left == 0:
-            _wait_for_reset(interval_start_time)
-            requests_left = STRAVA_RATE_LIMIT
-            interval_start_time = time.time()
-        elif _passed_reset_interval(interval_start_time):
-            requests_left = STRAVA_RATE_LIMIT
-            interval_start_time = time.time()
-        f_id = data['exercise_id']
-        f_name = data['exercise_name']
-        exercise = data['exercise_type']
-        try:
-            print(f'Uploading {f_name}...')
-            with open(path, 'r') as infile:
-                response = client.upload_activity(infile, 'gpx', name=f_name,
-                                                  description="Uploaded Samsung Health activity using Strava-nator",
-                                                  activity_type=exercise, external_id=f_id)
-            while response.is_processing:
-                time.sleep(5)
-                response.poll()
-                requests_left -= 1
-            if response.is_error:
-                print(f'Error: {response.error}')
-                response.raise_for_error()
-        except:
-            print(f'...failed while uploading: {f_id} ({f_name})')
-            continue
-        mark_uploaded(file_path, f_id)
-        requests_left -= 1
+    # NOTE :: The limiter's own sleeps are rate limit waits, the waits between polls are counted as they happen
+    requests_before, slept_before = limiter.requests, limiter.slept
+    try:
+        _pipeline_uploads(new_files, client, limiter, in_flight, journal, resume or {})
+    finally:
+        metrics.count('_upload_files', api_calls=limiter.requests - requests_before,
+                      sleep_seconds=limiter.slept - slept_before)
+
+
+def _pipeline_uploads(new_files: Iterable[Tuple[Union[str, InMemoryFile], Dict[str, str]]], client: Client,
+                      limiter: RateLimiter, in_flight: int, journal: Callable[[str, Optional[int], str], None],
+                      resume: Dict[str, int]):
+    """
+    Submits files while there's room for them and polls everything that's had time to process.
+    Files with an upload from an earlier run are polled instead of being sent again. Files are
+    only taken from new_files when there's room for them so it can be fed as they're built.
+
+    :param new_files: iterable of tuples of (path or in memory file, gpx_metadata)
+    :param client: client instance that should now be authorized
+    :param limiter: rate limiter fed by the client's responses
+    :param in_flight: max number of uploads to have processing at once
+    :param journal: called with (exercise id, upload id, status) when an upload is submitted and when it finishes
+    :param resume: dict of exercise id -> upload id for uploads an earlier run submitted but never saw finish
+    """
+    new_files = iter(new_files)
+    queue = deque()
+    pending = []  # type: List[Tuple[Union[str, InMemoryFile], ActivityUploader, Dict[str, str], float]]
+    exhausted = False
+    while queue or pending or not exhausted:
+        while len(pending) < in_flight:
+            if queue:
+                path, data = queue.popleft()
+            else:
+                path, data = next(new_files, (None, None))
+                if data is None:
+                    exhausted = True
+                    break
+                upload_id = resume.get(data['exercise_id'])
+                if upload_id is not None:
+                    print(f'Checking on {data["exercise_name"]} from the last run...')
+                    response = ActivityUploader(client, {'id': upload_id, 'external_id': data['exercise_id']},
+                                                raise_exc=False)
+                    # NOTE :: Submitted by the last run so it's had plenty of time to process, poll it right away
+                    pending.append((path, response, data, float('-inf')))
+                    continue
+            limiter.acquire()
+            response = _start_upload(client, path, data)
+            if limiter.last_status == 429:
+                queue.appendleft((path, data))
+                break
+            if response is None: continue
+            journal(data['exercise_id'], response.upload_id, 'submitted')
+            if not _finished_upload(response, data, journal):
+                pending.append((path, response, data, limiter.clock()))
+        if not pending: continue
+        # NOTE :: Strava takes a few seconds to process a file so don't poll anything younger than that
+        wait = max(0.0, min(p[3] for p in pending) + STRAVA_POLL_INTERVAL - limiter.clock())
+        limiter.sleep(wait)
+        metrics.count('_upload_files', sleep_seconds=wait)
+        still_pending = []
+        for path, response, data, submitted in pending:
+            if limiter.clock() - submitted < STRAVA_POLL_INTERVAL:
+                still_pending.append((path, response, data, submitted))
+                continue
+            limiter.acquire()
+            _poll_upload(client, response, limiter)
+            if limiter.last_status == 404:
+                # NOTE :: Strava has no record of the upload, send the file again (if it did make it we'll get a duplicate)
+                print(f'...lost track of {data["exercise_name"]} on Strava, sending it again')
+                journal(data['exercise_id'], response.upload_id, 'failed')
+                queue.append((path, data))
+                continue
+            if not _finished_upload(response, data, journal):
+                still_pending.append((path, response, data, limiter.clock()))
+        pending = still_pending
 
 
+def _poll_upload(client: Client, response: ActivityUploader, limiter: RateLimiter):
+    """
+    Checks on an upload. Only a successful response updates it, stravalib's own poll() would read
+    anything else (e.g. a 429's rate limit message) as the upload and lose its id.
+
+    :param client: client instance that should now be authorized
+    :param response: the upload
+    :param limiter: rate limiter fed by the client's responses
+    """
+    try:
+        result = client.protocol.get('/uploads/{upload_id}', upload_id=response.upload_id, check_for_errors=False)
+    except Exception:
+        return
+    if limiter.last_status is not None and 200 <= limiter.last_status < 300:
+        response.update_from_response(result, raise_exc=False)
+
 
-def _wait_for_reset(start_time: float):
+def _start_upload(client: Client, path: Union[str, InMemoryFile], data: Dict[str, str]) -> Optional[ActivityUploader]:
     """
-    Need to wait 15 minutes or have the 00, 15, 30, 45 time pass to reset rate limit
+    Sends a file to Strava without waiting for it to be processed
 
-    :param start_time: the time when the last burst of requests was made
+    :param client: client instance that should now be authorized
+    :param path: path to the gpx file (or the file itself if it's only in memory)
+    :param data: gpx_metadata for the file
+    :return: the upload to poll (None if it failed to send)
     """
-    time_since = (time.time() - start_time).total_seconds / 60
-    print('Ran out of requests. Need to wait 15 minutes or until an interval passes...')
-    while time_since < STRAVA_RATE_INTERVAL and not _passed_reset_interval(start_time):
-        time.sleep(10)
-        time_since = (time.time() - start_time).total_seconds / 60
+    f_id = data['exercise_id']
+    f_name = data['exercise_name']
+    exercise = data['exercise_type']
+    try:
+        print(f'Uploading {f_name}...')
+        if isinstance(path, InMemoryFile):
+            infile = io.BytesIO(path.content)
+        else:
+            infile = open(path, 'rb')
+        with infile:
+            metrics.count('_upload_files', bytes_read=infile.seek(0, io.SEEK_END))
+            infile.seek(0)
+            return client.upload_activity(infile, get_data_type(path), name=f_name,
+                                          description="Uploaded Samsung Health activity using Strava-nator",
+                                          activity_type=exercise, external_id=f_id)
+    except Exception:
+        print(f'...failed while uploading: {f_id} ({f_name})')
+        return None
 
 
-def _passed_reset_interval(start_time: float) -> bool:
+def _finished_upload(response: ActivityUploader, data: Dict[str, str],
+                     journal: Callable[[str, Optional[int], str], None]) -> bool:
     """
-    Whether or not the time has gone past an interval point
+    Checks on an upload and marks it as uploaded once Strava is done with it.
+    Strava rejecting it as a duplicate means an earlier upload already made it.
 
-    :param start_time: time when the last burst of requests started
-    :return: True if interval has been passed
+    :param response: the upload
+    :param data: gpx_metadata for the file
+    :param journal: called with (exercise id, upload id, status) once it's finished
+    :return: True if Strava is done processing it (successfully or not)
+    """
+    if response.is_processing: return False
+    duplicate_of = _duplicate_of(response.error)
+    if duplicate_of:
+        print(f'{data["exercise_name"]} is already on Strava (activity {duplicate_of})')
+        journal(data['exercise_id'], response.upload_id, 'uploaded')
+    elif response.is_error:
+        print(f'Error: {response.error}')
+        print(f'...failed while uploading: {data["exercise_id"]} ({data["exercise_name"]})')
+        journal(data['exercise_id'], response.upload_id, 'failed')
+    else:
+        print(f'Finished uploading {data["exercise_name"]}')
+        journal(data['exercise_id'], response.upload_id, 'uploaded')
+    return True
+
+
+def _duplicate_of(error: Optional[str]) -> Optional[str]:
+    """
+    :param error: error Strava gave for an upload, e.g. "123.gpx duplicate of activity 456"
+    :return: id of the activity it duplicates (None if it's not a duplicate)
     """
-    now = datetime.datetime.now()
-    start = datetime.datetime.utcfromtimestamp(start_time)
-    if now.hour != start.hour: return True
-    intervals = set(range(0, 60, STRAVA_RATE_INTERVAL))
-    minutes_since = set(range(max(start.minute, 1), now.minute))
-    return len(intervals.intersection(minutes_since)) > 0
+    match = DUPLICATE_ERROR.search(error or '')
+    return match.group(1) if match else None
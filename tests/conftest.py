@@ -0,0 +1,19 @@
+import pytest
+from pathlib import Path
+from src import activity_index, file_utils, generate_gpx
+from src.export_archive import close_archives
+
+
+@pytest.fixture
+def data_root(tmp_path: Path, monkeypatch) -> Path:
+    """
+    Moves the data folder (and the index in it) under tmp_path
+    """
+    root = tmp_path / 'data'
+    root.mkdir()
+    for module in (file_utils, activity_index, generate_gpx):
+        monkeypatch.setattr(module, 'get_data_root', lambda: root)
+    activity_index._connect.cache_clear()
+    yield root
+    activity_index._connect.cache_clear()
+    close_archives()
@@ -0,0 +1,76 @@
+import os
+import pytest
+from pathlib import Path
+from typing import Callable, List
+from benchmarks.synthetic_export import write_export
+from src.export_archive import get_archive
+from src.export_watcher import watch_exports
+
+INTERVAL = 60
+
+
+class StopWatching(Exception):
+    pass
+
+
+def _watch(folder: Path, steps: List[Callable[[], None]], on_exports: Callable[[List[str]], None]) -> List[float]:
+    """
+    Watches the folder, running the next step each time the watcher sleeps and stopping once they run out
+
+    :return: how long each sleep was
+    """
+    sleeps = []
+
+    def sleep(seconds: float):
+        sleeps.append(seconds)
+        if not steps: raise StopWatching()
+        steps.pop(0)()
+
+    with pytest.raises(StopWatching):
+        watch_exports([str(folder)], INTERVAL, on_exports, sleep=sleep)
+    return sleeps
+
+
+def _replace(path: Path, exercises: int):
+    """
+    Writes an export next to path and moves it into place like a finished copy would
+    """
+    write_export(str(path) + '.part', exercises, points=30)
+    os.replace(str(path) + '.part', str(path))
+
+
+def test_watch_syncs_new_and_replaced_exports(tmp_path: Path, data_root: Path):
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    first, second = folder / 'first.zip', folder / 'second.zip'
+    write_export(str(first), 3, points=30)
+    calls = []
+
+    def on_exports(file_paths: List[str]):
+        calls.append({os.path.basename(path): len(get_archive(path).exercise_files()) for path in file_paths})
+
+    replaced = []
+    steps = [lambda: write_export(str(second), 4, points=30), lambda: None,
+             lambda: replaced.append(get_archive(str(first))), lambda: _replace(first, 5), lambda: None]
+    sleeps = _watch(folder, steps, on_exports)
+    assert sleeps == [INTERVAL] * 6
+    # NOTE :: A new zip is only picked up once it's sat still for an interval
+    assert calls == [{'first.zip': 3}, {'first.zip': 3, 'second.zip': 4}, {'first.zip': 5, 'second.zip': 4}]
+    assert replaced[0].zip.fp is None
+
+
+def test_watch_skips_unreadable_zips_and_retries_failed_syncs(tmp_path: Path, data_root: Path):
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    write_export(str(folder / 'export.zip'), 3, points=30)
+    calls = []
+
+    def on_exports(file_paths: List[str]):
+        calls.append(sorted(os.path.basename(path) for path in file_paths))
+        if len(calls) == 2: raise Exception('Strava is down')
+
+    steps = [lambda: (folder / 'broken.zip').write_bytes(b'not a zip'), lambda: None,
+             lambda: write_export(str(folder / 'later.zip'), 2, points=30), lambda: None, lambda: None, lambda: None]
+    _watch(folder, steps, on_exports)
+    # NOTE :: The broken zip never joins a sync, the failed one is tried again an interval later and then left alone
+    assert calls == [['export.zip'], ['export.zip', 'later.zip'], ['export.zip', 'later.zip']]
@@ -0,0 +1,59 @@
+import pytest
+from pathlib import Path
+from benchmarks.synthetic_export import write_export
+from src import file_utils
+from src.activity_index import get_upload_files, mark_uploaded
+from src.file_utils import find_exports, prep_working_dir
+from src.generate_gpx import generate_gpx_files
+
+
+@pytest.fixture
+def exports(tmp_path: Path, data_root: Path):
+    """
+    Two monthly snapshots, the second has the same six exercises as the first plus two new ones
+    """
+    # NOTE :: Named so they sort by month, the zips are written in the same second so that's what orders them
+    write_export(str(tmp_path / '2020-01.zip'), 6, points=60, seed=1)
+    write_export(str(tmp_path / '2020-02.zip'), 8, points=60, seed=1)
+    file_paths = find_exports([str(tmp_path)])
+    for file_path in file_paths:
+        prep_working_dir(file_path)
+    return file_paths
+
+
+def _folders(file_paths):
+    """
+    :return: dict of exercise id -> export folder its upload file is in
+    """
+    return {data['exercise_id']: Path(path).relative_to(file_utils.get_data_root()).parts[0]
+            for path, data in get_upload_files(file_paths)}
+
+
+def test_exercise_is_only_generated_from_the_newest_export(exports, capsys):
+    generate_gpx_files(exports)
+    assert 'exercises left to a newer export' in capsys.readouterr().out
+    folders = _folders(exports)
+    assert folders and set(folders.values()) == {'2020-02'}
+    assert not list((file_utils.get_data_root() / '2020-01').rglob('*.gpx'))
+
+
+def test_unchanged_exercise_points_to_the_older_file(exports, capsys):
+    old, new = exports
+    generate_gpx_files([old])
+    before = _folders([old])
+    capsys.readouterr()
+    generate_gpx_files(exports)
+    assert 'were already generated from another export' in capsys.readouterr().out
+    folders = _folders(exports)
+    assert {exercise_id: folders[exercise_id] for exercise_id in before} == before
+    assert set(folders.values()) == {'2020-01', '2020-02'}
+    built = {path.stem for path in (file_utils.get_data_root() / '2020-02').rglob('*.gpx')}
+    assert built == set(folders) - set(before)
+
+
+def test_uploaded_exercise_is_left_out_of_every_export(exports):
+    generate_gpx_files(exports)
+    uploaded = sorted(_folders(exports))[0]
+    mark_uploaded(uploaded)
+    assert uploaded not in _folders(exports)
+    assert uploaded not in _folders(exports[:1])
@@ -0,0 +1,92 @@
+import io
+import os
+import struct
+import random
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from src.track import Track
+from src.fit_writer import write_fit, _crc, FIT_EPOCH, SEMICIRCLES_PER_DEGREE, SINT32, INVALID_UINT8
+
+RECORD_NUMBER = 20
+METADATA = {'exercise_type': 'run', 'exercise_name': 'Run (Strava-nator)'}
+
+
+def _bitwise_crc(data: bytes, crc: int = 0) -> int:
+    """
+    The FIT CRC (CRC-16/ARC) a bit at a time, straight from its definition
+    """
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def _track(count: int, seed: int = 0) -> Track:
+    rng = random.Random(seed)
+    start = 1_600_000_000
+    cadence = [float(rng.randint(75, 92)) if i % 7 else np.nan for i in range(count)]
+    return Track(np.arange(start, start + count, dtype=np.float64),
+                 42.3 + np.cumsum([rng.uniform(-1e-4, 1e-4) for _ in range(count)]),
+                 -71.1 + np.cumsum([rng.uniform(-1e-4, 1e-4) for _ in range(count)]),
+                 np.array([rng.uniform(5, 60) for _ in range(count)]),
+                 np.array([float(rng.randint(90, 180)) for _ in range(count)]),
+                 np.array(cadence))
+
+
+def _decode(content: bytes) -> Tuple[Dict[str, Any], List[Tuple[int, Dict[int, int]]]]:
+    """
+    :return: the file header and (global message number, field number -> value) for every data message
+    """
+    header_size, protocol, profile, data_size, magic, header_crc = struct.unpack('<BBHI4sH', content[:14])
+    header = {'size': header_size, 'data_size': data_size, 'magic': magic, 'crc': header_crc}
+    definitions = {}
+    messages = []
+    position, end = header_size, header_size + data_size
+    while position < end:
+        record_header = content[position]
+        position += 1
+        local_type = record_header & 0x0F
+        if record_header & 0x40:
+            _, architecture, global_number, count = struct.unpack('<BBHB', content[position:position + 5])
+            position += 5
+            fields = [struct.unpack('<BBB', content[position + 3 * i:position + 3 * i + 3]) for i in range(count)]
+            definitions[local_type] = (global_number, fields)
+            position += 3 * count
+            continue
+        global_number, fields = definitions[local_type]
+        values = {}
+        for number, size, base_type in fields:
+            code = {1: 'b', 2: 'h', 4: 'i'}[size] if base_type == SINT32 else {1: 'B', 2: 'H', 4: 'I'}[size]
+            values[number] = struct.unpack('<' + code, content[position:position + size])[0]
+            position += size
+        messages.append((global_number, values))
+    return header, messages
+
+
+def test_crc_matches_the_definition():
+    for size in (0, 1, 255, 256, 257, 511, 512, 4096, 70001):
+        data = os.urandom(size)
+        for crc in (0, 0x1234):
+            assert _crc(data, crc) == _bitwise_crc(data, crc)
+
+
+def test_fit_file_decodes_with_valid_crcs():
+    track = _track(3600)
+    outfile = io.BytesIO()
+    write_fit(outfile, METADATA, track)
+    content = outfile.getvalue()
+    header, messages = _decode(content)
+    assert header['size'] == 14 and header['magic'] == b'.FIT'
+    assert len(content) == 14 + header['data_size'] + 2
+    assert header['crc'] == _bitwise_crc(content[:12])
+    # NOTE :: Running the CRC over a file and the CRC at its end comes out to zero
+    assert _bitwise_crc(content) == 0
+    records = [values for number, values in messages if number == RECORD_NUMBER]
+    assert len(records) == 3600
+    np.testing.assert_array_equal([r[253] for r in records], track.start_time.astype(np.int64) - FIT_EPOCH)
+    np.testing.assert_allclose([r[0] / SEMICIRCLES_PER_DEGREE for r in records], track.latitude, atol=1e-7)
+    np.testing.assert_allclose([r[1] / SEMICIRCLES_PER_DEGREE for r in records], track.longitude, atol=1e-7)
+    np.testing.assert_allclose([r[2] / 5 - 500 for r in records], track.altitude, atol=0.1)
+    assert [r[3] for r in records] == track.heart_rate.astype(int).tolist()
+    assert [r[4] for r in records] == [INVALID_UINT8 if np.isnan(c) else int(c) for c in track.cadence]
@@ -0,0 +1,51 @@
+from typing import Dict, List, Optional
+from src.constants import STRAVA_MATCH_WINDOW
+from src.upload_activities import _skip_synced, _epoch
+
+NOON = '2020-06-01T12:00:00Z'
+
+
+def _file(exercise_id: str, start_time: str, end_time: Optional[str] = None):
+    return (f'{exercise_id}.gpx', {'exercise_id': exercise_id, 'exercise_name': f'Exercise {exercise_id}',
+                                   'start_time': start_time, 'end_time': end_time})
+
+
+def _activity(start_time: str, elapsed: float, activity_id: int):
+    return _epoch(start_time), elapsed, 'Run', activity_id
+
+
+def _skip(new_files: List, activities: List) -> Dict[str, List[str]]:
+    skipped = []
+    remaining = _skip_synced(new_files, sorted(activities), journal=lambda *entry: skipped.append(entry[0]))
+    return {'remaining': [data['exercise_id'] for _, data in remaining], 'skipped': skipped}
+
+
+def test_overlapping_exercise_is_skipped():
+    result = _skip([_file('a', NOON, '2020-06-01T13:00:00Z')], [_activity('2020-06-01T12:30:00Z', 600, 1)])
+    assert result == {'remaining': [], 'skipped': ['a']}
+
+
+def test_exercise_inside_a_long_activity_is_skipped():
+    # NOTE :: The long activity starts well before the exercise and a short one in between ends before it
+    activities = [_activity('2020-06-01T08:00:00Z', 8 * 3600, 1), _activity('2020-06-01T10:00:00Z', 600, 2)]
+    result = _skip([_file('a', NOON, '2020-06-01T12:30:00Z')], activities)
+    assert result == {'remaining': [], 'skipped': ['a']}
+
+
+def test_back_to_back_activities_are_not_overlaps():
+    activities = [_activity('2020-06-01T11:00:00Z', 3600, 1), _activity('2020-06-01T13:00:00Z', 600, 2)]
+    result = _skip([_file('a', NOON, '2020-06-01T13:00:00Z')], activities)
+    assert result == {'remaining': ['a'], 'skipped': []}
+
+
+def test_exercise_without_an_end_matches_near_its_start():
+    near = _activity('2020-06-01T12:00:30Z', 600, 1)
+    far = _activity(f'2020-06-01T12:{STRAVA_MATCH_WINDOW // 60 + 1:02d}:00Z', 600, 2)
+    assert _skip([_file('a', NOON)], [near]) == {'remaining': [], 'skipped': ['a']}
+    assert _skip([_file('a', NOON)], [far]) == {'remaining': ['a'], 'skipped': []}
+
+
+def test_only_overlapping_files_are_dropped():
+    new_files = [_file('a', NOON, '2020-06-01T12:30:00Z'), _file('b', '2020-06-02T12:00:00Z', '2020-06-02T12:30:00Z')]
+    result = _skip(new_files, [_activity('2020-06-01T12:10:00Z', 60, 1)])
+    assert result == {'remaining': ['b'], 'skipped': ['a']}
@@ -0,0 +1,136 @@
+import random
+from collections import defaultdict
+from typing import Any, Dict, List
+import numpy as np
+from src.track import TRACK_COLUMNS, EARTH_RADIUS, ELEVATION_SMOOTHING, Track, from_samples, merge_seconds, simplify, \
+    summarize
+
+
+def _samples(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    :return: Samsung style samples with times in ms, several to a second and some values left out
+    """
+    rng = random.Random(seed)
+    samples = []
+    for i in range(count):
+        sample = {'start_time': 1_600_000_000_000 + rng.randrange(0, count * 300)}
+        for column in TRACK_COLUMNS[1:]:
+            if rng.random() < 0.7: sample[column] = round(rng.uniform(1, 100), 3)
+        samples.append(sample)
+    return samples
+
+
+def _dict_merge(samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    How samples were merged before the track columns, one dict per second updated in read order
+    """
+    merged = defaultdict(dict)
+    for d in samples:
+        d = dict(d, start_time=d['start_time'] / 1000)
+        merged[round(d['start_time'])].update(d)
+    return list(sorted(merged.values(), key=lambda d: d['start_time']))
+
+
+def test_merge_seconds_matches_the_dict_merge():
+    samples = _samples(500)
+    expected = _dict_merge(samples)
+    merged = merge_seconds(from_samples(samples))
+    assert len(merged.start_time) == len(expected)
+    for name, column in zip(TRACK_COLUMNS, merged):
+        np.testing.assert_array_equal(column, np.array([d.get(name, np.nan) for d in expected], dtype=np.float64))
+
+
+def _meters(track: Track):
+    """
+    :return: x and y of every point in meters, projected the same way simplify does
+    """
+    latitude = np.radians(track.latitude)
+    return np.radians(track.longitude) * np.cos(latitude[0]) * EARTH_RADIUS, latitude * EARTH_RADIUS
+
+
+def _wander(count: int, seed: int = 0) -> Track:
+    """
+    :return: a wandering track with a point every second and a stop every few minutes
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 2e-5, (count, 2)) + [2e-5, 1e-5]
+    steps[(np.arange(count) // 60) % 5 == 4] = 0
+    latitude, longitude = 42.3 + np.cumsum(steps[:, 0]), -71.1 + np.cumsum(steps[:, 1])
+    return Track(1_600_000_000 + np.arange(count, dtype=np.float64), latitude, longitude,
+                 np.full(count, 20.0), np.full(count, 140.0), np.full(count, np.nan))
+
+
+def test_simplify_keeps_the_route_within_tolerance():
+    track = _wander(2000)
+    simplified = simplify(track, 3, 10_000)
+    kept = np.searchsorted(track.start_time, simplified.start_time)
+    assert kept[0] == 0 and kept[-1] == len(track.start_time) - 1
+    assert len(kept) < len(track.start_time) / 3
+    x, y = _meters(track)
+    for first, last in zip(kept[:-1], kept[1:]):
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first:last + 1] - x[first], y[first:last + 1] - y[first]
+        length = dx * dx + dy * dy
+        along = np.clip((px * dx + py * dy) / length, 0, 1) if length else 0
+        assert np.hypot(px - along * dx, py - along * dy).max() <= 3 + 1e-6
+
+
+def test_simplify_keeps_a_point_every_max_gap():
+    track = _wander(2000)
+    simplified = simplify(track, 1000, 10)
+    assert simplified.start_time[0] == track.start_time[0] and simplified.start_time[-1] == track.start_time[-1]
+    assert np.diff(simplified.start_time).max() <= 10
+    assert len(simplified.start_time) <= len(track.start_time) / 10 + 2
+
+
+def test_simplify_keeps_the_far_end_of_an_out_and_back():
+    latitude = np.concatenate([np.linspace(42.3, 42.31, 50), np.linspace(42.31, 42.3, 50)[1:]])
+    track = Track(np.arange(len(latitude), dtype=np.float64), latitude, np.full(len(latitude), -71.1),
+                  *(np.full(len(latitude), np.nan) for _ in range(3)))
+    simplified = simplify(track, 3, 10_000)
+    assert simplified.latitude.tolist() == [42.3, 42.31, 42.3]
+
+
+def _climb(count: int) -> Track:
+    """
+    :return: a track heading due north, one point a second, climbing a meter a point with GPS noise on top
+    """
+    latitude = 42.3 + np.arange(count) * 1e-4
+    altitude = 100 + np.arange(count) + np.where(np.arange(count) % 2, 0.5, -0.5)
+    heart_rate = np.full(count, np.nan)
+    heart_rate[::2] = 120 + np.arange(0, count, 2) % 40
+    return Track(1_600_000_000 + np.arange(count, dtype=np.float64), latitude, np.full(count, -71.1), altitude,
+                 heart_rate, np.full(count, np.nan))
+
+
+def test_summarize_distance_and_duration():
+    stats = summarize(_climb(101))
+    # NOTE :: Due north so every step is the same arc along the meridian
+    assert stats['distance'] == round(EARTH_RADIUS * np.radians(100 * 1e-4), 1)
+    assert stats['duration'] == 100
+
+
+def test_summarize_smooths_out_elevation_noise():
+    stats = summarize(_climb(101))
+    # NOTE :: The moving average starts and ends half a window in, noise alone would add another 50 meters
+    climbed = 100 - (ELEVATION_SMOOTHING - 1)
+    assert abs(stats['elevation_gain'] - climbed) <= 0.5
+
+
+def test_summarize_heart_rate_skips_missing_values():
+    track = _climb(101)
+    heart_rate = track.heart_rate[~np.isnan(track.heart_rate)]
+    stats = summarize(track._replace(heart_rate=np.where(np.arange(101) == 4, 0, track.heart_rate)))
+    rest = np.delete(heart_rate, 2)
+    assert stats['average_heart_rate'] == round(float(rest.mean()), 1)
+    assert stats['max_heart_rate'] == float(rest.max())
+    stats = summarize(track._replace(heart_rate=np.full(101, np.nan)))
+    assert stats['average_heart_rate'] is None and stats['max_heart_rate'] is None
+
+
+def test_summarize_leaves_points_without_location_out_of_the_distance():
+    track = _climb(101)
+    no_location = track._replace(latitude=np.where(np.arange(101) == 50, np.nan, track.latitude),
+                                 altitude=np.where(np.arange(101) == 50, 0, track.altitude))
+    assert summarize(no_location)['distance'] == summarize(track)['distance']
+    assert summarize(no_location)['duration'] == 100
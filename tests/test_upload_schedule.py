@@ -0,0 +1,210 @@
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from stravalib.client import ActivityUploader
+from src.rate_limiter import RateLimiter, DAY_SECONDS
+from src.file_utils import InMemoryFile
+from src.upload_activities import _upload_files
+
+SHORT_SECONDS = 15 * 60
+# NOTE :: A few minutes into a 15 minute window so the first one is cut short like it would be for real
+START = 1_600_000_000.0 + 7 * 60
+RATE_LIMITED = {'message': 'Rate Limit Exceeded',
+                'errors': [{'resource': 'Application', 'field': 'rate limit', 'code': 'exceeded'}]}
+
+
+class FakeClock:
+    """
+    Simulated time, sleeping just moves it forward
+    """
+
+    def __init__(self, now: float = START):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class StubStrava:
+    """
+    Stands in for the client with Strava's upload endpoints and its 15 minute and daily windows on the
+    simulated clock. Every response is fed to the limiter the way the requests hook would.
+    """
+
+    def __init__(self, clock: FakeClock, limiter: RateLimiter, short_limit: int = 100, daily_limit: int = 1000,
+                 processing: float = 3, drain_after: Optional[int] = None):
+        self.protocol = self
+        self.clock = clock
+        self.limiter = limiter
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.processing = processing
+        # NOTE :: Another app uses up the rest of the 15 minute window once this many requests have been counted
+        self.drain_after = drain_after
+        self.usage = [0, 0]
+        self.windows = self._current_windows()
+        self.requests = []  # type: List[float]
+        self.rate_limited = []  # type: List[float]
+        self.uploads = {}  # type: Dict[int, Dict[str, Any]]
+        self.sent = Counter()
+
+    def upload_activity(self, infile, data_type: str, name: str, description: str, activity_type: str,
+                        external_id: str) -> ActivityUploader:
+        if not self._count(): raise Exception('Rate Limit Exceeded')
+        upload_id = len(self.uploads) + 1
+        self.uploads[upload_id] = {'external_id': external_id, 'ready_at': self.clock.time() + self.processing}
+        self.sent[external_id] += 1
+        self._respond(201)
+        return ActivityUploader(self, {'id': upload_id, 'external_id': external_id,
+                                       'status': 'Your activity is still being processed.'}, raise_exc=False)
+
+    def get(self, url: str, check_for_errors: bool = True, upload_id: Optional[int] = None) -> Dict[str, Any]:
+        if not self._count(): return RATE_LIMITED
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            self._respond(404)
+            return {'message': 'Record Not Found', 'errors': [{'resource': 'Upload', 'code': 'not found'}]}
+        self._respond(200)
+        if self.clock.time() < upload['ready_at']:
+            return {'id': upload_id, 'external_id': upload['external_id'],
+                    'status': 'Your activity is still being processed.'}
+        return {'id': upload_id, 'external_id': upload['external_id'], 'activity_id': upload_id,
+                'status': 'Your activity is ready.'}
+
+    def _count(self) -> bool:
+        """
+        :return: False (after answering with a 429) if the request is over either limit
+        """
+        windows = self._current_windows()
+        if windows[0] != self.windows[0]: self.usage[0] = 0
+        if windows[1] != self.windows[1]: self.usage[1] = 0
+        self.windows = windows
+        if self.drain_after is not None and len(self.requests) == self.drain_after:
+            self.usage[0] = self.short_limit
+            self.drain_after = None
+        if self.usage[0] >= self.short_limit or self.usage[1] >= self.daily_limit:
+            self.rate_limited.append(self.clock.time())
+            self._respond(429)
+            return False
+        self.usage[0] += 1
+        self.usage[1] += 1
+        self.requests.append(self.clock.time())
+        return True
+
+    def _respond(self, status: int):
+        self.limiter.update_from_headers({'X-RateLimit-Limit': f'{self.short_limit},{self.daily_limit}',
+                                          'X-RateLimit-Usage': f'{self.usage[0]},{self.usage[1]}'}, status)
+
+    def _current_windows(self):
+        now = self.clock.time()
+        return int(now // SHORT_SECONDS), int(now // DAY_SECONDS)
+
+
+def _setup(**kwargs):
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock.time, sleep=clock.sleep)
+    return clock, limiter, StubStrava(clock, limiter, **kwargs)
+
+
+def _files(count: int) -> List:
+    return [(InMemoryFile(f'e{i}.gpx', b'<gpx/>'),
+             {'exercise_id': f'e{i}', 'exercise_name': f'Exercise {i}', 'exercise_type': 'run'})
+            for i in range(count)]
+
+
+def _upload(files: List, client: StubStrava, limiter: RateLimiter) -> List:
+    journal = []
+    _upload_files(files, client, limiter, journal=lambda *entry: journal.append(entry))
+    return journal
+
+
+def test_schedule_stays_inside_both_windows():
+    clock, limiter, strava = _setup()
+    journal = _upload(_files(10000), strava, limiter)
+    assert strava.rate_limited == []
+    assert len(strava.sent) == 10000 and set(strava.sent.values()) == {1}
+    assert len({entry[0] for entry in journal if entry[2] == 'uploaded'}) == 10000
+    assert max(Counter(int(t // SHORT_SECONDS) for t in strava.requests).values()) <= 100
+    assert max(Counter(int(t // DAY_SECONDS) for t in strava.requests).values()) <= 1000
+    # NOTE :: An upload and a poll each, so 20 days of the daily cap
+    assert len({int(t // DAY_SECONDS) for t in strava.requests}) == 20
+
+
+def test_rate_limited_upload_waits_for_the_next_window():
+    clock, limiter, strava = _setup(drain_after=2)
+    journal = _upload(_files(5), strava, limiter)
+    assert len(strava.rate_limited) == 1
+    limited_window = int(strava.rate_limited[0] // SHORT_SECONDS)
+    assert all(int(t // SHORT_SECONDS) > limited_window for t in strava.requests[2:])
+    assert set(strava.sent.values()) == {1} and len(strava.sent) == 5
+    assert not [entry for entry in journal if entry[2] == 'failed']
+
+
+def test_rate_limited_poll_keeps_the_upload():
+    clock, limiter, strava = _setup(drain_after=5)
+    journal = _upload(_files(5), strava, limiter)
+    assert len(strava.rate_limited) == 1
+    assert sum(strava.sent.values()) == 5
+    assert not [entry for entry in journal if entry[2] == 'failed']
+    assert sorted(entry[0] for entry in journal if entry[2] == 'uploaded') == [f'e{i}' for i in range(5)]
+
+
+def test_file_that_fails_to_send_after_a_429_is_skipped():
+    clock, limiter, strava = _setup()
+    limiter.last_status = 429
+    files = [('/does/not/exist.gpx', {'exercise_id': 'missing', 'exercise_name': 'Missing', 'exercise_type': 'run'})]
+    files += _files(1)
+    journal = []
+    worker = threading.Thread(target=_upload_files, args=(files, strava, limiter),
+                              kwargs={'journal': lambda *entry: journal.append(entry)}, daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    assert strava.sent == Counter({'e0': 1})
+    assert ('e0', 1, 'uploaded') in journal
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _journal_until(submitted: int, journal: Dict[str, int]):
+    """
+    :return: a journal that keeps the uploads still processing like the index does and dies once
+    the given number of uploads have been submitted
+    """
+    def write(exercise_id: str, upload_id: Optional[int], status: str):
+        if status == 'submitted':
+            journal[exercise_id] = upload_id
+        else:
+            journal.pop(exercise_id, None)
+        if len(journal) == submitted: raise Interrupted()
+    return write
+
+
+def test_interrupted_run_is_picked_up_without_sending_again():
+    clock, limiter, strava = _setup()
+    unfinished = {}  # type: Dict[str, int]
+    try:
+        _upload_files(_files(5), strava, limiter, journal=_journal_until(3, unfinished))
+    except Interrupted:
+        pass
+    assert sorted(unfinished) == ['e0', 'e1', 'e2']
+    clock.sleep(60)
+    journal = []
+    _upload_files(_files(5), strava, limiter, journal=lambda *entry: journal.append(entry), resume=unfinished)
+    assert strava.sent == Counter({f'e{i}': 1 for i in range(5)})
+    assert sorted(entry[0] for entry in journal if entry[2] == 'uploaded') == [f'e{i}' for i in range(5)]
+    assert [entry for entry in journal if entry[2] == 'submitted' and entry[0] in unfinished] == []
+
+
+def test_upload_strava_lost_is_sent_again():
+    clock, limiter, strava = _setup()
+    journal = []
+    _upload_files(_files(2), strava, limiter, journal=lambda *entry: journal.append(entry), resume={'e0': 99})
+    assert strava.sent == Counter({'e0': 1, 'e1': 1})
+    assert ('e0', 99, 'failed') in journal
+    assert sorted(entry[0] for entry in journal if entry[2] == 'uploaded') == ['e0', 'e1']